@@ -0,0 +1,268 @@
+"""
+Flattening of Braze /campaigns/data_series responses into campaign_analytics rows.
+
+Which metrics belong to which channel is declared once in CHANNEL_METRICS. Column types (and the fields of the
+nested ios_push/android_push records) are read from bq_schemas.json and compiled into one generated extractor
+function per channel, so a row costs one dict lookup and one conversion per field.
+"""
+import os
+import json
+import logging
+import traceback
+from functools import lru_cache
+
+from campaign_names import parse_campaign_name
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bq_schemas.json')
+ANALYTICS_SCHEMA_CHANNEL = 'all'    # bq_schemas.json 에서 campaign_analytics 테이블 항목의 channel
+
+PUSH_CHANNELS = ('ios_push', 'android_push')
+# 채널별로 row에 들어가는 지표. RECORD 컬럼인 채널(ios_push, android_push)은 스키마의 필드를 그대로 사용
+CHANNEL_METRICS = {
+    'webhook': ('sent',),
+    'email': ('sent', 'opens', 'unique_opens', 'clicks', 'unique_clicks', 'delivered'),
+    'trigger_in_app_message': ('impressions', 'clicks', 'first_button_clicks', 'second_button_clicks'),
+}
+# 이 지표가 0이면 해당 날짜에 발송/노출이 없었던 것
+CHANNEL_ACTIVITY_METRIC = {'trigger_in_app_message': 'impressions'}
+COMMON_METRICS = ('conversions', 'conversions1', 'conversions2', 'conversions3', 'unique_recipients', 'revenue')
+
+_CONVERTERS = {'INTEGER': int, 'FLOAT': float}
+
+
+@lru_cache(maxsize=None)
+def analytics_columns():
+    """
+    :return: {column name: converter} for the metric columns of campaign_analytics, and
+             {record name: ((field, converter), ...)} for its RECORD columns
+    """
+    with open(SCHEMA_PATH) as f:
+        tables = json.load(f)
+    schema = next(table['schema'] for table in tables if table.get('channel') == ANALYTICS_SCHEMA_CHANNEL)
+    columns = {}
+    records = {}
+    for column in schema:
+        if column['type'] == 'RECORD':
+            records[column['name']] = tuple((field['name'], _CONVERTERS[field['type']])
+                                            for field in column['fields'] if field['type'] in _CONVERTERS)
+        elif column['type'] in _CONVERTERS:
+            columns[column['name']] = _CONVERTERS[column['type']]
+    return columns, records
+
+
+def channel_family(channels):
+    """
+    :param channels: Braze channel names (details 'channels'), or the ','-joined channel column of an analytics row
+    :return: 'push' when any of them is ios_push/android_push, 'inappmsg' for in-app messages, else the first channel
+             (the "channel" of the bq_schemas.json table its rows also go to)
+    """
+    if isinstance(channels, str):
+        channels = channels.split(',')
+    if any(ch in PUSH_CHANNELS for ch in channels):
+        return 'push'
+    if 'trigger_in_app_message' in channels:
+        return 'inappmsg'
+    return channels[0]
+
+
+def _as_timestamp(value):
+    return value + 'T00:00:00' if len(value) == 10 else value     # DATE -> 그날 0시
+
+
+def _as_integer(value):
+    return int(round(value)) if isinstance(value, float) else int(value)
+
+
+_PROJECTION_CONVERTERS = {'INTEGER': _as_integer, 'FLOAT': float, 'TIMESTAMP': _as_timestamp}
+
+
+def compile_row_projection(table_schema):
+    """
+    :param table_schema: 'schema' of a bq_schemas.json table other than campaign_analytics
+    :return: function mapping an analytics row to the columns of table_schema. A column is read from its "source"
+             (default: its own name), RECORD columns are projected field by field, INTEGER/FLOAT/TIMESTAMP values are
+             converted (revenue 1234.7 -> 1235, date '2022-06-01' -> '2022-06-01T00:00:00') and missing ones are None
+    """
+    columns = []
+    for column in table_schema:
+        fields = compile_row_projection(column['fields']) if column['type'] == 'RECORD' else None
+        columns.append((column['name'], column.get('source', column['name']),
+                        _PROJECTION_CONVERTERS.get(column['type']), fields))
+
+    def project(row):
+        projected = {}
+        for name, source, convert, fields in columns:
+            value = row.get(source)
+            if value is not None:
+                if fields is not None:
+                    value = fields(value)
+                elif convert is not None:
+                    value = convert(value)
+            projected[name] = value
+        return projected
+
+    return project
+
+
+def _fields(names):
+    columns, _ = analytics_columns()
+    return tuple((name, columns[name]) for name in names)
+
+
+def _field_lines(target, fields):
+    return [f"    {target}[{name!r}] = {convert.__name__}(v) if (v := get({name!r})) else None"
+            for name, convert in fields]
+
+
+def _compile(name, lines):
+    namespace = {}
+    exec('\n'.join(lines) + '\n', namespace)   # noqa: S102 - source is generated from bq_schemas.json only
+    return namespace[name]
+
+
+@lru_cache(maxsize=None)
+def compile_record_extractor(ch):
+    """
+    :return: function(values) -> nested record stored under `ch` (ios_push/android_push fields), one .get per field
+    """
+    _, records = analytics_columns()
+    lines = ["def extract(values):", "    get = values.get", "    record = {}"]
+    lines += _field_lines('record', records[ch])
+    lines += ["    return record"]
+    return _compile('extract', lines)
+
+
+@lru_cache(maxsize=None)
+def compile_common_extractor():
+    """
+    :return: function(values, row) adding the conversion/revenue columns shared by every channel to row
+    """
+    lines = ["def extract(values, row):", "    get = values.get"]
+    lines += _field_lines('row', _fields(COMMON_METRICS))
+    return _compile('extract', lines)
+
+
+@lru_cache(maxsize=None)
+def compile_variation_extractor(ch):
+    """
+    :return: function(var, base, variation_name, utm_campaign_name) -> analytics row of one variation,
+             or None when nothing was sent/impressed. A missing activity metric raises KeyError.
+             Keys are inserted in the same order as the original hand-written dicts.
+             Returns None for channels that have no metric mapping.
+    """
+    _, records = analytics_columns()
+    lines = ["def build(var, base, variation_name, utm_campaign_name):",
+             f"    if int(var[{CHANNEL_ACTIVITY_METRIC.get(ch, 'sent')!r}]) == 0:",
+             "        return None",
+             "    get = var.get",
+             "    row = base.copy()"]
+    if ch in records:
+        lines += ["    record = row[%r] = {}" % ch]
+        lines += _field_lines('record', records[ch])
+    elif ch in CHANNEL_METRICS:
+        lines += _field_lines('row', _fields(CHANNEL_METRICS[ch]))
+    else:
+        return None
+    lines += [f"    row['channel'] = {ch!r}",
+              "    row['variation_name'] = variation_name",
+              "    row['utm_campaign_name'] = utm_campaign_name"]
+    lines += _field_lines('row', _fields(COMMON_METRICS))
+    lines += ["    return row"]
+    return _compile('build', lines)
+
+
+def _handle_error():
+    message = 'Error. Cause: %s' % (traceback.format_exc())
+    print(message)
+
+
+def flatten_analytics_day(day_data, day, id, name):
+    """
+    Flattens one day (one entry of result['data']) of a /campaigns/data_series response.
+    :return: list of analytics rows (empty for an entry without messages), or None when a unified ios/aos campaign
+             has no push data
+    """
+    campaigns_analytics = []
+    messages = day_data.get('messages')  # 캠페인의 하루치 analytics 데이터.
+    if not messages:    # 발송 없는 날짜는 messages 가 비어서 옴
+        return campaigns_analytics
+    campaigns_analytic = {"date": day, "id": id, "original_name": name}
+    parsed_name = parse_campaign_name(name)   # 캠페인 이름당 한번만 파싱 (lru_cache)
+    campaigns_analytic.update({"utm_campaign_source": parsed_name.utm_campaign_source,
+                               "utm_campaign_medium": parsed_name.utm_campaign_medium,
+                               "utm_campaign_name": parsed_name.utm_campaign_name})
+    if not parsed_name.valid:
+        logger.info("utm naming conversion is wrong: %s", campaigns_analytic)
+
+    abtest = parsed_name.abtest
+
+    if len(messages) > 1:  # 통합 채널 = ios/aos & variation 없음
+        push_record = compile_record_extractor(PUSH_CHANNELS[0])
+        try:
+            for ch in messages.keys():
+                try:
+                    logger.debug("통합 채널 ch:%s, name:%s\nraw_result:%s", ch, name, messages[ch][0])
+                except IndexError:
+                    break
+
+                if int(messages[ch][0]['sent']) == 0:
+                    logger.debug("Not sent. No data today")
+                    continue
+
+                campaigns_analytic[ch] = push_record(messages[ch][0])
+
+            campaigns_analytic["channel"] = ','.join(messages.keys())
+            compile_common_extractor()(day_data, campaigns_analytic)
+        except Exception:
+            _handle_error()
+            return None
+
+        if campaigns_analytic.get('ios_push') or campaigns_analytic.get('android_push'):
+            logger.debug("1 ios/aos campaigns analytic added: %s", campaigns_analytic)
+            campaigns_analytics.append(campaigns_analytic)
+        else:
+            return None
+
+    else:  # 개별 채널 & variation 있을수 있음
+        ch = next(iter(messages))
+        logger.debug("개별 채널 ch:%s, name:%s\nraw_result:%s", ch, name, messages[ch])
+        build = compile_variation_extractor(ch)
+        if build is None:
+            logger.info("Unknown channel %s. not analytics data", ch)
+            return campaigns_analytics
+
+        for index, var in enumerate(messages[ch]):  # variation loop
+            logger.debug("<%d> variation: %s", index + 1, var)
+
+            # variation별 필드 update
+            utm_campaign_name = ''
+            if var.get('variation_name'):
+                if var['variation_name'] == 'Control Group':
+                    logger.debug("Control Group. not analytics data")
+                    continue
+                elif var['variation_name'] in abtest:
+                    utm_campaign_name = var['variation_name']
+                    variation_name = var['variation_name']
+                else:
+                    utm_campaign_name = campaigns_analytic['utm_campaign_name']
+                    variation_name = var['variation_name']
+            else:
+                variation_name = ""
+                logger.debug("no variation name")
+
+            # channel별 필드 update
+            try:
+                var_analytics = build(var, campaigns_analytic, variation_name, utm_campaign_name)
+            except KeyError:
+                continue
+            if var_analytics is None:
+                logger.debug("Not impressed. No data today" if ch in CHANNEL_ACTIVITY_METRIC else "Not sent. No data today")
+                continue
+
+            logger.debug("1 %s campaigns analytic added: %s", ch, var_analytics)
+            campaigns_analytics.append(var_analytics)
+
+    return campaigns_analytics
@@ -0,0 +1,363 @@
+"""
+Microbenchmark of the analytics row builder on recorded /campaigns/data_series payloads.
+
+Compares analytics_transform.flatten_analytics_day with the hand-written per-channel blocks it replaced and
+checks that both produce byte-identical rows.
+
+    python benchmarks/bench_analytics_rows.py [--repeat 2000]
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+import traceback
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics_transform import flatten_analytics_day, compile_variation_extractor  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'data_series.json')
+
+
+def legacy_flatten_analytics_day(day_data, day, id, name):
+    """Hand-written per-channel flattening that flatten_analytics_day replaced, kept as the reference output."""
+    campaigns_analytics = []
+    messages = day_data['messages']  # 캠페인의 하루치 analytics 데이터.
+    campaigns_analytic = {"date": day, "id": id, "original_name": name}
+    utm = name.split('$')
+
+    if len(utm) > 3:
+        campaigns_analytic.update(
+            {"utm_campaign_source": utm[-3], "utm_campaign_medium": utm[-2], "utm_campaign_name": utm[-1]})
+    else:
+        campaigns_analytic.update({"utm_campaign_source": '', "utm_campaign_medium": '', "utm_campaign_name": ''})
+        print(f"utm naming conversion is wrong: {campaigns_analytic}")
+
+    abtest = campaigns_analytic["utm_campaign_name"].split(',')
+
+    if len(messages) > 1:  # 통합 채널 = ios/aos & variation 없음
+        try:
+            for ch in messages.keys():
+                try:
+                    print(f"통합 채널 ch:{ch}, name:{name}\nraw_result:{messages[ch][0]}")
+                except IndexError:
+                    break
+
+                if int(messages[ch][0]['sent']) == 0:
+                    print(f"Not sent. No data today")
+                    continue
+
+                campaigns_analytic[ch] = {
+                    "sent": int(messages[ch][0]['sent']) if messages[ch][0].get('sent') else None,
+                    "direct_opens": int(messages[ch][0]['direct_opens']) if messages[ch][0].get(
+                        'direct_opens') else None,
+                    "total_opens": int(messages[ch][0]['total_opens']) if messages[ch][0].get(
+                        'total_opens') else None,
+                    "bounces": int(messages[ch][0]['bounces']) if messages[ch][0].get('bounces') else None,
+                    "body_clicks": int(messages[ch][0]['body_clicks']) if messages[ch][0].get(
+                        'body_clicks') else None}
+
+            campaigns_analytic.update({"channel": ','.join([ch for ch in messages.keys()]),
+                                       "conversions": int(day_data['conversions']) if day_data.get('conversions') else None,
+                                       "conversions1": int(day_data['conversions1']) if day_data.get('conversions1') else None,
+                                       "conversions2": int(day_data['conversions2']) if day_data.get('conversions2') else None,
+                                       "conversions3": int(day_data['conversions3']) if day_data.get('conversions3') else None,
+                                       "unique_recipients": int(day_data['unique_recipients']) if
+                                       day_data.get('unique_recipients') else None,
+                                       "revenue": float(day_data['revenue']) if day_data.get(
+                                           'revenue') else None})
+        except Exception:
+            traceback.print_exc()
+            return None
+
+        if campaigns_analytic.get('ios_push') or campaigns_analytic.get('android_push'):
+            print(f"1 ios/aos campaigns analytic added: {campaigns_analytic}")
+            campaigns_analytics.append(campaigns_analytic)
+        else:
+            return None
+
+
+    else:  # 개별 채널 & variation 있을수 있음
+        ch = next(iter(messages))
+        print(f"개별 채널 ch:{ch}, name:{name}\nraw_result:{messages[ch]}")
+        for index, var in enumerate(messages[ch]):  # variation loop
+            print(f"<{index + 1}> variation: {var}")
+
+            # variation별 필드 update
+            utm_campaign_name = ''
+            if var.get('variation_name'):
+                if var['variation_name'] == 'Control Group':
+                    print("Control Group. not analytics data")
+                    continue
+                elif var['variation_name'] in abtest:
+                    utm_campaign_name = var['variation_name']
+                    variation_name = var['variation_name']
+                else:
+                    utm_campaign_name = campaigns_analytic['utm_campaign_name']
+                    variation_name = var['variation_name']
+            else:
+                variation_name = ""
+                print(f"no variation name")
+
+            # channel별 필드 update
+            if ch in ['ios_push', 'android_push']:
+                var_analytics = campaigns_analytic.copy()
+                try:
+                    if int(var['sent']) == 0:
+                        print(f"Not sent. No data today")
+                        continue
+                    var_analytics[ch] = {"sent": int(var['sent']) if var.get('sent') else None,
+                                         "direct_opens": int(var['direct_opens']) if var.get(
+                                             'direct_opens') else None,
+                                         "total_opens": int(var['total_opens']) if var.get('total_opens') else None,
+                                         "bounces": int(var['bounces']) if var.get('bounces') else None,
+                                         "body_clicks": int(var['body_clicks']) if var.get('body_clicks') else None}
+
+                    var_analytics.update({"channel": ch,
+                                          "variation_name": variation_name,
+                                          "utm_campaign_name": utm_campaign_name,
+                                          "conversions": int(var['conversions']) if var.get(
+                                              'conversions') else None,
+                                          "conversions1": int(var['conversions1']) if var.get(
+                                              'conversions1') else None,
+                                          "conversions2": int(var['conversions2']) if var.get(
+                                              'conversions2') else None,
+                                          "conversions3": int(var['conversions3']) if var.get(
+                                              'conversions3') else None,
+                                          "unique_recipients": int(var['unique_recipients']) if var.get(
+                                              'unique_recipients') else None,
+                                          "revenue": float(var['revenue']) if var.get('revenue') else None})
+                except KeyError:
+                    continue
+
+            elif ch == 'webhook':
+                var_analytics = campaigns_analytic.copy()
+                try:
+                    if int(var['sent']) == 0:
+                        print(f"Not sent. No data today")
+                        continue
+                    var_analytics.update(
+                        {"sent": int(var['sent']) if var.get('sent') else None,  # "errors": int(var['errors'])
+                         "channel": ch,
+                         "variation_name": variation_name,
+                         "utm_campaign_name": utm_campaign_name,
+                         "conversions": int(var['conversions']) if var.get('conversions') else None,
+                         "conversions1": int(var['conversions1']) if var.get('conversions1') else None,
+                         "conversions2": int(var['conversions2']) if var.get('conversions2') else None,
+                         "conversions3": int(var['conversions3']) if var.get('conversions3') else None,
+                         "unique_recipients": int(var['unique_recipients']) if var.get(
+                             'unique_recipients') else None,
+                         "revenue": float(var['revenue']) if var.get('revenue') else None})
+
+                except KeyError:
+                    continue
+
+            elif ch == 'email':
+                var_analytics = campaigns_analytic.copy()
+                try:
+                    if int(var['sent']) == 0:
+                        print(f"Not sent. No data today")
+                        continue
+                    var_analytics.update({"sent": int(var['sent']) if var.get('sent') else None,
+                                          "opens": int(var['opens']) if var.get('opens') else None,
+                                          "unique_opens": int(var['unique_opens']) if var.get(
+                                              'unique_opens') else None,
+                                          "clicks": int(var['clicks']) if var.get('clicks') else None,
+                                          "unique_clicks": int(var['unique_clicks']) if var.get(
+                                              'unique_clicks') else None,
+                                          "delivered": int(var['delivered']) if var.get('delivered') else None,
+                                          "channel": ch,
+                                          "variation_name": variation_name,
+                                          "utm_campaign_name": utm_campaign_name,
+                                          "conversions": int(var['conversions']) if var.get(
+                                              'conversions') else None,
+                                          "conversions1": int(var['conversions1']) if var.get(
+                                              'conversions1') else None,
+                                          "conversions2": int(var['conversions2']) if var.get(
+                                              'conversions2') else None,
+                                          "conversions3": int(var['conversions3']) if var.get(
+                                              'conversions3') else None,
+                                          "unique_recipients": int(var['unique_recipients']) if var.get(
+                                              'unique_recipients') else None,
+                                          "revenue": float(var['revenue']) if var.get('revenue') else None})
+                except KeyError:
+                    continue
+
+            elif ch == 'trigger_in_app_message':
+                var_analytics = campaigns_analytic.copy()
+                try:
+                    if int(var['impressions']) == 0:
+                        print(f"Not impressed. No data today")
+                        continue
+                    var_analytics.update(
+                        {"impressions": int(var['impressions']) if var.get('impressions') else None,
+                         "clicks": int(var['clicks']) if var.get('clicks') else None,
+                         "first_button_clicks": int(var['first_button_clicks']) if var.get(
+                             'first_button_clicks') else None,
+                         "second_button_clicks": int(var['second_button_clicks']) if var.get(
+                             'second_button_clicks') else None,
+                         "channel": ch,
+                         "variation_name": variation_name,
+                         "utm_campaign_name": utm_campaign_name,
+                         "conversions": int(var['conversions']) if var.get('conversions') else None,
+                         "conversions1": int(var['conversions1']) if var.get('conversions1') else None,
+                         "conversions2": int(var['conversions2']) if var.get('conversions2') else None,
+                         "conversions3": int(var['conversions3']) if var.get('conversions3') else None,
+                         "unique_recipients": int(var['unique_recipients']) if var.get(
+                             'unique_recipients') else None,
+                         "revenue": float(var['revenue']) if var.get('revenue') else None})
+                except KeyError:
+                    continue
+
+            print(f"1 {ch} campaigns analytic added: {var_analytics}")
+            campaigns_analytics.append(var_analytics)
+
+    return campaigns_analytics
+
+
+def legacy_variation_row(ch, var, campaigns_analytic, variation_name, utm_campaign_name):
+    """The per-channel if/elif block of legacy_flatten_analytics_day, for the row-builder-only timing."""
+    if ch in ['ios_push', 'android_push']:
+        if int(var['sent']) == 0:
+            return None
+        var_analytics = campaigns_analytic.copy()
+        var_analytics[ch] = {"sent": int(var['sent']) if var.get('sent') else None,
+                             "direct_opens": int(var['direct_opens']) if var.get('direct_opens') else None,
+                             "total_opens": int(var['total_opens']) if var.get('total_opens') else None,
+                             "bounces": int(var['bounces']) if var.get('bounces') else None,
+                             "body_clicks": int(var['body_clicks']) if var.get('body_clicks') else None}
+        var_analytics.update({"channel": ch,
+                              "variation_name": variation_name,
+                              "utm_campaign_name": utm_campaign_name,
+                              "conversions": int(var['conversions']) if var.get('conversions') else None,
+                              "conversions1": int(var['conversions1']) if var.get('conversions1') else None,
+                              "conversions2": int(var['conversions2']) if var.get('conversions2') else None,
+                              "conversions3": int(var['conversions3']) if var.get('conversions3') else None,
+                              "unique_recipients": int(var['unique_recipients']) if var.get(
+                                  'unique_recipients') else None,
+                              "revenue": float(var['revenue']) if var.get('revenue') else None})
+    elif ch == 'webhook':
+        if int(var['sent']) == 0:
+            return None
+        var_analytics = campaigns_analytic.copy()
+        var_analytics.update(
+            {"sent": int(var['sent']) if var.get('sent') else None,
+             "channel": ch,
+             "variation_name": variation_name,
+             "utm_campaign_name": utm_campaign_name,
+             "conversions": int(var['conversions']) if var.get('conversions') else None,
+             "conversions1": int(var['conversions1']) if var.get('conversions1') else None,
+             "conversions2": int(var['conversions2']) if var.get('conversions2') else None,
+             "conversions3": int(var['conversions3']) if var.get('conversions3') else None,
+             "unique_recipients": int(var['unique_recipients']) if var.get('unique_recipients') else None,
+             "revenue": float(var['revenue']) if var.get('revenue') else None})
+    elif ch == 'email':
+        if int(var['sent']) == 0:
+            return None
+        var_analytics = campaigns_analytic.copy()
+        var_analytics.update({"sent": int(var['sent']) if var.get('sent') else None,
+                              "opens": int(var['opens']) if var.get('opens') else None,
+                              "unique_opens": int(var['unique_opens']) if var.get('unique_opens') else None,
+                              "clicks": int(var['clicks']) if var.get('clicks') else None,
+                              "unique_clicks": int(var['unique_clicks']) if var.get('unique_clicks') else None,
+                              "delivered": int(var['delivered']) if var.get('delivered') else None,
+                              "channel": ch,
+                              "variation_name": variation_name,
+                              "utm_campaign_name": utm_campaign_name,
+                              "conversions": int(var['conversions']) if var.get('conversions') else None,
+                              "conversions1": int(var['conversions1']) if var.get('conversions1') else None,
+                              "conversions2": int(var['conversions2']) if var.get('conversions2') else None,
+                              "conversions3": int(var['conversions3']) if var.get('conversions3') else None,
+                              "unique_recipients": int(var['unique_recipients']) if var.get(
+                                  'unique_recipients') else None,
+                              "revenue": float(var['revenue']) if var.get('revenue') else None})
+    else:
+        if int(var['impressions']) == 0:
+            return None
+        var_analytics = campaigns_analytic.copy()
+        var_analytics.update(
+            {"impressions": int(var['impressions']) if var.get('impressions') else None,
+             "clicks": int(var['clicks']) if var.get('clicks') else None,
+             "first_button_clicks": int(var['first_button_clicks']) if var.get('first_button_clicks') else None,
+             "second_button_clicks": int(var['second_button_clicks']) if var.get('second_button_clicks') else None,
+             "channel": ch,
+             "variation_name": variation_name,
+             "utm_campaign_name": utm_campaign_name,
+             "conversions": int(var['conversions']) if var.get('conversions') else None,
+             "conversions1": int(var['conversions1']) if var.get('conversions1') else None,
+             "conversions2": int(var['conversions2']) if var.get('conversions2') else None,
+             "conversions3": int(var['conversions3']) if var.get('conversions3') else None,
+             "unique_recipients": int(var['unique_recipients']) if var.get('unique_recipients') else None,
+             "revenue": float(var['revenue']) if var.get('revenue') else None})
+    return var_analytics
+
+
+def load_fixtures(path=FIXTURES):
+    with open(path) as f:
+        return json.load(f)
+
+
+def run(flatten, fixtures):
+    rows = []
+    for fixture in fixtures:
+        for day_data in fixture['response'].get('data') or []:
+            rows.append(flatten(day_data, fixture['day'], fixture['campaign_id'], fixture['name']))
+    return rows
+
+
+def variations(fixtures):
+    """:return: (channel, variation) pairs of every single-channel payload"""
+    base = {"date": "", "id": "", "original_name": "", "utm_campaign_source": "", "utm_campaign_medium": "",
+            "utm_campaign_name": ""}
+    pairs = []
+    for fixture in fixtures:
+        for day_data in fixture['response'].get('data') or []:
+            if len(day_data['messages']) == 1:
+                ch, variation_list = next(iter(day_data['messages'].items()))
+                pairs.extend((ch, var, base) for var in variation_list)
+    return pairs
+
+
+def run_rows(pairs):
+    return [compile_variation_extractor(ch)(var, base, 'variation', 'utm') for ch, var, base in pairs]
+
+
+def run_legacy_rows(pairs):
+    return [legacy_variation_row(ch, var, base, 'variation', 'utm') for ch, var, base in pairs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        legacy_rows = run(legacy_flatten_analytics_day, fixtures)
+        rows = run(flatten_analytics_day, fixtures)
+        assert json.dumps(rows) == json.dumps(legacy_rows), 'analytics rows differ from the reference output'
+
+        legacy_time = timeit.timeit(lambda: run(legacy_flatten_analytics_day, fixtures), number=args.repeat)
+        compiled_time = timeit.timeit(lambda: run(flatten_analytics_day, fixtures), number=args.repeat)
+
+    pairs = variations(fixtures)
+    assert json.dumps(run_rows(pairs)) == json.dumps(run_legacy_rows(pairs)), 'variation rows differ'
+    legacy_row_time = timeit.timeit(lambda: run_legacy_rows(pairs), number=args.repeat)
+    compiled_row_time = timeit.timeit(lambda: run_rows(pairs), number=args.repeat)
+
+    per_run = len(fixtures) * args.repeat
+    per_row = len(pairs) * args.repeat
+    print(f"output identical: {sum(len(r or []) for r in rows)} rows from {len(fixtures)} payloads")
+    print("flatten_analytics_day (console output discarded)")
+    print(f"  hand-written: {legacy_time / per_run * 1e6:8.2f} us/payload")
+    print(f"  compiled:     {compiled_time / per_run * 1e6:8.2f} us/payload  ({legacy_time / compiled_time:.2f}x)")
+    print("row builder only")
+    print(f"  hand-written: {legacy_row_time / per_row * 1e6:8.2f} us/variation")
+    print(f"  compiled:     {compiled_row_time / per_row * 1e6:8.2f} us/variation  "
+          f"({legacy_row_time / compiled_row_time:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Microbenchmark of campaign name and last_sent parsing.
+
+Compares campaign_names.parse_campaign_name / parse_braze_timestamp with the inline split/re.match/strptime code
+they replaced, on a synthetic campaign list shaped like the production one (one-off and always-on campaigns,
+A/B tests, badly named campaigns, both last_sent formats), and checks that both give the same result.
+
+    python benchmarks/bench_campaign_names.py [--campaigns 5000] [--days 30] [--repeat 5]
+"""
+import os
+import re
+import sys
+import random
+import timeit
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from campaign_names import parse_campaign_name, parse_braze_timestamp  # noqa: E402
+
+SOURCES = ('app_push', 'email', 'kakao', 'app', 'sms')
+MEDIUMS = ('push', 'email', 'webhook', 'inapp')
+
+
+def make_names(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2022, 6, 1)
+    names = []
+    for i in range(count):
+        title = f"campaign_{i}"
+        if rng.random() < 0.7:     # 대부분 일회성 캠페인
+            title = (start + timedelta(days=rng.randrange(120))).strftime('%y%m%d_') + title
+        if rng.random() < 0.05:    # utm 규칙 어긴 이름
+            names.append(title)
+            continue
+        utm_campaign = f"{rng.randrange(2206, 2212)}_{i}"
+        if rng.random() < 0.15:    # A/B 테스트
+            utm_campaign = ','.join(f"{utm_campaign}_{v}" for v in 'abc'[:rng.randrange(2, 4)])
+        names.append(f"{title}${rng.choice(SOURCES)}${rng.choice(MEDIUMS)}${utm_campaign}")
+    return names
+
+
+def make_timestamps(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2022, 6, 1)
+    stamps = []
+    for _ in range(count):
+        sent = (start + timedelta(seconds=rng.randrange(120 * 86400))).strftime('%Y-%m-%dT%H:%M:%S')
+        stamps.append(sent + ('+00:00' if rng.random() < 0.8 else 'Z'))
+    return stamps
+
+
+def legacy_parse_name(name):
+    utm = name.split('$')
+    if len(utm) > 3:
+        fields = (utm[-3], utm[-2], utm[-1])
+    else:
+        fields = ('', '', '')
+    return fields + (tuple(fields[2].split(',')),)
+
+
+def legacy_parse_timestamp(value):
+    if re.match('\\d{4}-\\d{2}-\\d{2}T\\d{2}:\\d{2}:\\d{2}$', value[:-6]):
+        return datetime.strptime(value[:-6], "%Y-%m-%dT%H:%M:%S")
+    elif re.match('\\d{4}-\\d{2}-\\d{2}T\\d{2}:\\d{2}:\\d{2}Z', value):
+        return datetime.strptime(value[:-1], "%Y-%m-%dT%H:%M:%S")
+    return None
+
+
+def run_names(parse, names, days):
+    # 캠페인 이름은 하루치/variation마다 다시 파싱됨
+    for _ in range(days):
+        for name in names:
+            parse(name)
+
+
+def run_timestamps(parse, stamps):
+    for stamp in stamps:
+        parse(stamp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--campaigns', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    names = make_names(args.campaigns)
+    stamps = make_timestamps(args.campaigns)
+    for name in names:
+        parsed = parse_campaign_name(name)
+        assert legacy_parse_name(name) == parsed[:4], name
+    for stamp in stamps:
+        assert legacy_parse_timestamp(stamp) == parse_braze_timestamp(stamp), stamp
+
+    parse_campaign_name.cache_clear()
+    per_name = args.repeat * args.days * len(names)
+    legacy_name_time = timeit.timeit(lambda: run_names(legacy_parse_name, names, args.days), number=args.repeat)
+    cached_name_time = timeit.timeit(lambda: run_names(parse_campaign_name, names, args.days), number=args.repeat)
+    per_stamp = args.repeat * len(stamps)
+    legacy_stamp_time = timeit.timeit(lambda: run_timestamps(legacy_parse_timestamp, stamps), number=args.repeat)
+    fast_stamp_time = timeit.timeit(lambda: run_timestamps(parse_braze_timestamp, stamps), number=args.repeat)
+
+    print(f"output identical: {len(names)} names, {len(stamps)} timestamps")
+    print(f"campaign name ({args.days} days per name)")
+    print(f"  split:        {legacy_name_time / per_name * 1e9:8.1f} ns/name")
+    print(f"  lru_cache:    {cached_name_time / per_name * 1e9:8.1f} ns/name  "
+          f"({legacy_name_time / cached_name_time:.2f}x)")
+    print("last_sent")
+    print(f"  re+strptime:  {legacy_stamp_time / per_stamp * 1e9:8.1f} ns/value")
+    print(f"  fast parser:  {fast_stamp_time / per_stamp * 1e9:8.1f} ns/value  "
+          f"({legacy_stamp_time / fast_stamp_time:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Offline throughput benchmarks of the Braze fetch + transform path, against fake_braze.FakeBrazeServer.
+
+    pip install pytest-benchmark
+    python -m pytest benchmarks/test_bench_pipeline.py --benchmark-only
+
+The recorded payloads of fixtures/data_series.json are replicated to BENCH_CAMPAIGNS campaigns and served with
+BENCH_LATENCY seconds per response. Every benchmark reports campaigns/sec in its extra_info.
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import braze_with_bq  # noqa: E402
+from fake_braze import FakeBrazeServer  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'data_series.json')
+BENCH_CAMPAIGNS = 200
+BENCH_LATENCY = 0.005
+BENCH_DAY = '2022-06-01'
+
+
+def make_fixtures(count=BENCH_CAMPAIGNS):
+    with open(FIXTURES) as f:
+        recorded = json.load(f)
+    campaigns = []
+    data_series = {}
+    for index in range(count):
+        case = recorded[index % len(recorded)]
+        campaign_id = f"{case['campaign_id']}-{index}"
+        campaigns.append({'id': campaign_id, 'name': case['name'], 'is_api_campaign': False, 'tags': [],
+                          'last_edited': BENCH_DAY + 'T00:00:00+00:00'})
+        data_series[campaign_id] = case['response']
+    return {'campaigns': campaigns, 'details': {}, 'data_series': data_series}
+
+
+@pytest.fixture(scope='module')
+def fixtures():
+    return make_fixtures()
+
+
+@pytest.fixture
+def fake_braze(fixtures, request):
+    options = getattr(request, 'param', {})
+    server = FakeBrazeServer(fixtures, latency=BENCH_LATENCY, seed=0, **options).start()
+    previous_url = braze_with_bq.BRAZE_URL
+    braze_with_bq.configure_braze(url=server.url, token='bench')
+    logging.getLogger('analytics_transform').setLevel(logging.WARNING)
+    yield server
+    braze_with_bq.configure_braze(url=previous_url)
+    server.stop()
+
+
+def fetch_and_transform(campaigns):
+    with ThreadPoolExecutor(max_workers=braze_with_bq.BRAZE_MAX_WORKERS) as executor:
+        results = executor.map(
+            lambda campaign: braze_with_bq.get_today_campaign_analytics_from_id_name(
+                [campaign['id'], campaign['name']], BENCH_DAY), campaigns)
+        return sum(len(rows or []) for rows in results)
+
+
+def mock_bq_client():
+    """BigQuery client whose load jobs finish at once (the writer records their stats after result())."""
+    client = mock.MagicMock()
+    client.load_table_from_file.return_value = mock.MagicMock(error_result=None, started=None, output_rows=0)
+    return client
+
+
+def report(benchmark, campaigns):
+    benchmark.extra_info['campaigns'] = campaigns
+    benchmark.extra_info['campaigns_per_sec'] = campaigns / benchmark.stats.stats.mean
+
+
+def test_fetch_transform_throughput(benchmark, fake_braze, fixtures):
+    campaigns = fixtures['campaigns']
+    rows = benchmark.pedantic(fetch_and_transform, args=(campaigns,), rounds=3, iterations=1)
+    assert rows > 0
+    report(benchmark, len(campaigns))
+
+
+@pytest.mark.parametrize('fake_braze', [{'throttle_rate': 0.05, 'retry_after': 0.05}], indirect=True)
+def test_fetch_transform_throughput_throttled(benchmark, fake_braze, fixtures):
+    """Same path with 5% of requests throttled: slower, but no row may be lost."""
+    campaigns = fixtures['campaigns']
+    expected = sum(len(braze_with_bq.analytics_rows_from_data_series(fixtures['data_series'][c['id']], BENCH_DAY,
+                                                                         c['id'], c['name']) or [])
+                   for c in campaigns)
+    with mock.patch.object(braze_with_bq, 'BRAZE_BACKOFF_BASE', 0.01):
+        rows = benchmark.pedantic(fetch_and_transform, args=(campaigns,), rounds=3, iterations=1)
+    assert rows == expected
+    assert fake_braze.stats['throttled'] > 0
+    report(benchmark, len(campaigns))
+
+
+def test_pipeline_throughput(benchmark, fake_braze, fixtures):
+    """Fetch -> transform -> staging files (every analytics table) of run_analytics_pipeline; BigQuery calls go to
+    a mock client."""
+    campaigns = fixtures['campaigns']
+    batch = {BENCH_DAY: {'id': [c['id'] for c in campaigns], 'name': [c['name'] for c in campaigns]}}
+    tables = braze_with_bq.get_analytics_tables()
+
+    def run():
+        return asyncio.run(braze_with_bq.run_analytics_pipeline(mock_bq_client(), batch, tables))
+
+    failed_days = benchmark.pedantic(run, rounds=3, iterations=1)
+    assert failed_days == []
+    report(benchmark, len(campaigns))
@@ -1,23 +1,77 @@
 import traceback
-from datetime import datetime, timedelta, date
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone, date
+from functools import lru_cache
+from collections import deque, namedtuple
+from urllib.parse import urlencode
+from email.utils import parsedate_to_datetime
 
 import os
-import re
 import json
+import asyncio
+import time
+import uuid
+import hashlib
+import random
+import argparse
 import logging
+import sqlite3
+import tempfile
+import threading
+import weakref
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
-from google.oauth2 import service_account
+from google.cloud.bigquery.retry import DEFAULT_RETRY, DEFAULT_JOB_RETRY
 
+try:
+    import pyarrow  # noqa: F401 - enables the Arrow/Storage Read API path of select_oneoff_campaigns_from_bq
+except ImportError:
+    pyarrow = None
 
-with open('bq_schemas.json') as f:
-    bq_schema = json.load(f)
+try:
+    import ijson    # /campaigns/details 를 스트리밍으로 파싱 (messages 본문을 메모리에 올리지 않음)
+except ImportError:
+    ijson = None
 
-BRAZE_TOKEN = ''    # PLEASE INPUT THE BRAZE TOKEN
+from analytics_transform import (flatten_analytics_day, channel_family, compile_row_projection,
+                                 ANALYTICS_SCHEMA_CHANNEL)
+from campaign_names import parse_campaign_name, parse_braze_timestamp, kst_day_window, oneoff_date_prefix
+from run_metrics import RunMetrics, metrics
+
+
+logger = logging.getLogger(__name__)
+
+BQ_SCHEMAS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bq_schemas.json')
+BRAZE_TOKEN = os.environ.get('BRAZE_TOKEN', '')    # PLEASE INPUT THE BRAZE TOKEN (or set BRAZE_TOKEN)
 HEADER = {'Authorization': 'Bearer ' + str(BRAZE_TOKEN)}
-GCP_PROJECT = 'elandmallbigquery'
-GOOGLE_APPLICATION_CREDENTIALS = 'elandmallbigquery-privatekey.json'    # PLEASE ADD THE SERVICE ACCOUNT PRIVATE KEY
+BRAZE_URL = os.environ.get('BRAZE_URL', 'https://rest.iad-06.braze.com')   # fake_braze.py 로 바꾸면 오프라인 실행
+BRAZE_MAX_WORKERS = 8           # 동시에 보내는 Braze API 요청 수
+BRAZE_RATE_LIMIT_RESERVE = 10   # X-RateLimit-Remaining 이 이 값 이하로 떨어지면 Reset 시각까지 대기
+BRAZE_PAGE_PREFETCH = 4         # /campaigns/list 미리 요청해 두는 페이지 수
+BRAZE_TIMEOUT = (5, 60)         # seconds. (connect, read)
+BRAZE_MAX_RETRIES = 5           # 429/5xx/연결 오류 재시도 횟수. 넘으면 BrazeAPIError
+BRAZE_RETRY_STATUSES = (429, 500, 502, 503, 504)
+BRAZE_MISSING_CAMPAIGN_STATUSES = (400, 404)    # Braze 에서 삭제된 캠페인: 해당 캠페인만 건너뜀 (날짜 전체를 실패시키지 않음)
+BRAZE_BACKOFF_BASE = 1.0        # seconds. 재시도 대기 = 0 ~ min(BASE * 2^attempt, MAX) 사이 랜덤 (jitter)
+BRAZE_BACKOFF_MAX = 60.0
+BRAZE_BREAKER_FAILURES = 5      # 연속 5xx/연결 오류가 이 횟수가 되면 모든 worker를 BRAZE_BREAKER_COOLDOWN 동안 멈춤
+BRAZE_BREAKER_COOLDOWN = 30.0
+BRAZE_CACHE_PATH = '.braze_cache.sqlite'
+BRAZE_CACHE_OPEN_DAY_TTL = 60 * 60     # seconds. 아직 끝나지 않은 날짜/디테일 응답 보관 시간
+BRAZE_CACHEABLE_ENDPOINTS = ('/campaigns/details', '/campaigns/data_series')
+BRAZE_COMPACT_CACHE_SUFFIX = '#compact'    # 스트리밍 파싱 결과(CampaignDetail)는 원본 응답과 다른 키로 캐시
+CAMPAIGN_STATE_PATH = '.campaign_state.sqlite'
+STAGING_MAX_ROWS = 500000                   # analytics 적재 파일 하나당 최대 row 수
+STAGING_MAX_BYTES = 256 * 1024 * 1024       # analytics 적재 파일 하나당 최대 크기
+PIPELINE_QUEUE_SIZE = 64        # --pipeline: 단계 사이 큐 크기. 다음 단계가 밀리면 앞 단계가 대기 (backpressure)
+GCP_PROJECT = os.environ.get('GCP_PROJECT', 'elandmallbigquery')
+GOOGLE_APPLICATION_CREDENTIALS = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS',
+                                                'elandmallbigquery-privatekey.json')    # PLEASE ADD THE SERVICE ACCOUNT PRIVATE KEY
+BQ_RETRY = DEFAULT_RETRY.with_deadline(600)         # API 호출 재시도 (5xx, rate limit)
+BQ_JOB_RETRY = DEFAULT_JOB_RETRY.with_deadline(1800)  # 쿼리 job 자체가 일시적 오류(backendError, rateLimitExceeded)로 실패하면 다시 실행
 
 YESTERDAY4BQ = datetime.strftime(datetime.now()-timedelta(1), '_%Y%m%d')
 TDB_YESTERDAY = datetime.strftime(datetime.now()-timedelta(2), '%Y-%m-%d')
@@ -25,148 +79,864 @@ YESTERDAY = datetime.strftime(datetime.now()-timedelta(1), '%Y-%m-%d')
 TODAY = datetime.strftime(datetime.now(), '%Y-%m-%d')
 
 
+@lru_cache(maxsize=None)
+def get_bq_schema():
+    """
+    :return: table definitions of bq_schemas.json, read once on first use
+    """
+    with open(BQ_SCHEMAS_PATH) as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def get_gcp_credentials(credentials_path=GOOGLE_APPLICATION_CREDENTIALS):
+    """
+    :return: service-account credentials, loaded once per key file
+    """
+    from google.oauth2 import service_account   # 인증이 필요할 때만 import
+    return service_account.Credentials.from_service_account_file(credentials_path)
+
+
 def connect_to_bq():
-    credentials = service_account.Credentials.from_service_account_file(GOOGLE_APPLICATION_CREDENTIALS)
+    credentials = get_gcp_credentials(GOOGLE_APPLICATION_CREDENTIALS)
     client = bigquery.client.Client(project=GCP_PROJECT, credentials=credentials)
     return client
 
 
-BQ = connect_to_bq()
-job_config = bigquery.LoadJobConfig()
+_bq_client = None
+_bq_client_lock = threading.Lock()
+_client_metrics = weakref.WeakKeyDictionary()    # RunContext 의 BigQuery client -> 그 context 의 RunMetrics
 
 
-def get_all_campaign_list():
+def get_bq_client():
     """
-    :return: list of all campaigns info (id, name, is_api_campaign, tags, last_edited)
+    :return: the process-wide BigQuery client, created on first use so that importing this module does no I/O
     """
-    # 처음에만 전체 리스트 가져와서 빅쿼리 테이블에 저장. 그 이후에는 하루 전에 생성된 캠페인 있는지 get_updated_campaign_list()
-    url = 'https://rest.iad-06.braze.com/campaigns/list?&page='
-    response = requests.get(url+str(0), headers=HEADER)
-    result = response.json()
-    # print(type(result), result)
-    print("Getting all campaigns in braze", end="")
-    campaigns = []
-    if 'campaigns' in result:
-        next_page = 0
-        while len(result['campaigns']) != 0:
-            campaigns.extend(result['campaigns'])
-            print("...", end="")
+    global _bq_client
+    with _bq_client_lock:
+        if _bq_client is None:
+            _bq_client = connect_to_bq()
+    return _bq_client
+
+
+def bq_metrics(client):
+    """:return: RunMetrics of the RunContext that created client, the module-level metrics for any other client"""
+    try:
+        return _client_metrics.get(client, metrics)
+    except TypeError:   # weakref 를 못 거는 client
+        return metrics
+
+
+def __getattr__(name):
+    # BQ, bq_schema 는 예전에 import 시점에 만들어지던 모듈 속성. 처음 접근할 때 만들어서 반환
+    if name == 'BQ':
+        return get_bq_client()
+    if name == 'bq_schema':
+        return get_bq_schema()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class BrazeRateLimiter:
+    """
+    Paces Braze REST calls using the X-RateLimit-Remaining / X-RateLimit-Reset response headers.
+    Shared by every worker so that concurrent requests draw from the same budget.
+    :param run_metrics: RunMetrics the waits are counted in, default the module-level metrics
+    """
+
+    def __init__(self, reserve=BRAZE_RATE_LIMIT_RESERVE, run_metrics=None):
+        self.reserve = reserve
+        self.metrics = run_metrics or metrics
+        self.remaining = None
+        self.reset_at = None
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            delay = 0
+            if self.remaining is not None and self.remaining <= self.reserve and self.reset_at is not None:
+                delay = self.reset_at - time.time()
+                if delay <= 0:
+                    self.remaining = None   # window already reset, wait for the next response to refresh it
+            if self.remaining is not None:
+                self.remaining -= 1     # reserve a slot for the request about to be sent
+        if delay > 0:
+            logger.warning('Braze rate limit almost exhausted, sleeping %.1fs', delay)
+            self.metrics.incr('braze_rate_limit_waits')
+            with self.metrics.timer('braze_rate_limit_sleep'):
+                time.sleep(delay)
+
+    def update(self, headers):
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining = int(remaining)
+            reset = float(reset)
+        except ValueError:
+            return
+        if reset < 10 ** 9:     # seconds until reset rather than an epoch timestamp
+            reset += time.time()
+        with self._lock:
+            self.remaining = remaining
+            self.reset_at = reset
+
+
+class BrazeAPIError(Exception):
+    """A Braze call that still failed after BRAZE_MAX_RETRIES, or failed with a status that is not retried."""
+
+    def __init__(self, endpoint, status_code=None, body=None, cause=None):
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.body = body
+        self.cause = cause
+        super().__init__(f"Braze {endpoint} failed: " + (f"HTTP {status_code} {body}" if status_code else repr(cause)))
+
+
+class BrazeCircuitBreaker:
+    """
+    Pauses every worker at once while Braze throttles (429, for its Retry-After) or keeps failing (failure_threshold
+    consecutive 5xx/connection errors, for cooldown seconds), instead of each worker hammering it with retries.
+    :param run_metrics: RunMetrics the waits and trips are counted in, default the module-level metrics
+    """
+
+    def __init__(self, failure_threshold=BRAZE_BREAKER_FAILURES, cooldown=BRAZE_BREAKER_COOLDOWN, run_metrics=None):
+        self.failure_threshold = failure_threshold
+        self.metrics = run_metrics or metrics
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self.open_until - time.time()
+            if delay <= 0:
+                return
+            self.metrics.incr('braze_breaker_waits')
+            with self.metrics.timer('braze_breaker_sleep'):
+                time.sleep(delay)
+
+    def trip(self, delay):
+        with self._lock:
+            self.open_until = max(self.open_until, time.time() + delay)
+        logger.warning('Braze circuit open, pausing all requests for %.1fs', delay)
+        self.metrics.incr('braze_breaker_trips')
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            tripped = self.failures >= self.failure_threshold
+            if tripped:
+                self.failures = 0
+        if tripped:
+            self.trip(self.cooldown)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+
+def retry_after_seconds(headers):
+    """
+    :return: seconds of the Retry-After header (delta seconds or HTTP date), or None
+    """
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """
+    :param base, cap: default to BRAZE_BACKOFF_BASE / BRAZE_BACKOFF_MAX, read at call time
+    :return: full-jitter exponential backoff of the given retry attempt (0-based)
+    """
+    base = BRAZE_BACKOFF_BASE if base is None else base
+    cap = BRAZE_BACKOFF_MAX if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class BrazeResponseCache:
+    """
+    On-disk (SQLite) store of Braze responses keyed on endpoint + campaign_id + window (length, ending_at).
+    A window ending before today (UTC) is a closed day whose analytics no longer change, so it never expires;
+    everything else (details, today's window) is kept for open_day_ttl seconds.
+    With offline=True every stored response is served whatever its expiry, and a miss raises LookupError instead of
+    calling Braze, so recorded responses can be replayed.
+    """
+
+    def __init__(self, path=BRAZE_CACHE_PATH, open_day_ttl=BRAZE_CACHE_OPEN_DAY_TTL, offline=False):
+        self.path = path
+        self.open_day_ttl = open_day_ttl
+        self.offline = offline
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS braze_responses (
+                                key TEXT PRIMARY KEY,
+                                endpoint TEXT,
+                                campaign_id TEXT,
+                                window TEXT,
+                                body TEXT,
+                                stored_at REAL,
+                                expires_at REAL)""")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(endpoint, params):
+        return endpoint + '?' + urlencode(sorted((params or {}).items()))
+
+    @staticmethod
+    def is_closed_window(params):
+        ending_at = (params or {}).get('ending_at')
+        return bool(ending_at) and ending_at[:10] < datetime.utcnow().strftime('%Y-%m-%d')
+
+    def get(self, endpoint, params):
+        """
+        :return: cached JSON response, or None on a miss
+        """
+        key = self.make_key(endpoint, params)
+        with self._lock:
+            row = self._conn.execute("SELECT body, expires_at FROM braze_responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and (self.offline or row[1] is None or row[1] > time.time()):
+                self.stats['hits'] += 1
+                return json.loads(row[0])
+            self.stats['expired' if row is not None else 'misses'] += 1
+        if self.offline:
+            raise LookupError(f"No recorded Braze response for {key}")
+        return None
+
+    def put(self, endpoint, params, result):
+        params = params or {}
+        now = time.time()
+        expires_at = None if self.is_closed_window(params) else now + self.open_day_ttl
+        window = f"{params.get('length', '')}|{params.get('ending_at', '')}"
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO braze_responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (self.make_key(endpoint, params), endpoint, params.get('campaign_id'), window,
+                                json.dumps(result), now, expires_at))
+            self._conn.commit()
+            self.stats['stores'] += 1
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_braze_session = None
+_braze_session_lock = threading.Lock()
+braze_rate_limiter = BrazeRateLimiter()
+braze_circuit_breaker = BrazeCircuitBreaker()
+braze_cache = None
+
+
+def enable_braze_cache(path=BRAZE_CACHE_PATH, open_day_ttl=BRAZE_CACHE_OPEN_DAY_TTL, offline=False):
+    """
+    Puts a BrazeResponseCache under braze_get for the /campaigns/details and /campaigns/data_series calls.
+    :return: the cache, whose .stats holds hit/miss counts
+    """
+    global braze_cache
+    braze_cache = BrazeResponseCache(path, open_day_ttl=open_day_ttl, offline=offline)
+    return braze_cache
+
+
+def configure_braze(url=None, token=None):
+    """
+    Points every following Braze call at another REST endpoint and/or token, e.g. a local fake_braze server.
+    """
+    global BRAZE_URL, BRAZE_TOKEN, HEADER, _braze_session
+    with _braze_session_lock:
+        if url is not None:
+            BRAZE_URL = url.rstrip('/')
+        if token is not None:
+            BRAZE_TOKEN = token
+            HEADER = {'Authorization': 'Bearer ' + str(BRAZE_TOKEN)}
+        if _braze_session is not None:
+            _braze_session.close()
+            _braze_session = None   # 다음 호출에서 새 헤더로 다시 만듦
+
+
+def get_braze_session():
+    """
+    :return: requests.Session shared by all Braze calls, keeping TCP/TLS connections alive between requests
+    """
+    global _braze_session
+    with _braze_session_lock:
+        if _braze_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=BRAZE_MAX_WORKERS, pool_maxsize=BRAZE_MAX_WORKERS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(HEADER)
+            _braze_session = session
+    return _braze_session
+
+
+class RunContext:
+    """
+    Everything one run needs that used to be a module global: the Braze workspace (REST cluster URL, token),
+    its session, rate limiter, circuit breaker and response cache, the GCP project and credentials, the
+    logical run date with the dates derived from it, and the metrics of its Braze calls and BigQuery jobs.
+    Several contexts can run side by side in one process (see WorkspaceScheduler); every Braze/BigQuery function
+    takes ctx=None, which means default_context(), the context of the module globals.
+    """
+
+    def __init__(self, workspace='default', braze_url=None, braze_token=None, gcp_project=None,
+                 credentials_path=None, run_date=None, max_workers=BRAZE_MAX_WORKERS, max_days=None,
+                 rate_limit_reserve=BRAZE_RATE_LIMIT_RESERVE, ga_sessions_dataset=None, cache_path=None,
+                 checkpoint_path=None):
+        self.workspace = workspace
+        self.braze_url = (braze_url or BRAZE_URL).rstrip('/')
+        self.braze_token = braze_token if braze_token is not None else BRAZE_TOKEN
+        self.gcp_project = gcp_project or GCP_PROJECT
+        self.credentials_path = credentials_path or GOOGLE_APPLICATION_CREDENTIALS
+        self.ga_sessions_dataset = ga_sessions_dataset or GA_SESSIONS_DATASET
+        self.max_workers = max_workers          # 동시에 보내는 Braze API 요청 수 (이 workspace)
+        self.max_days = max_days or BACKFILL_MAX_WORKERS    # 동시에 처리하는 날짜 수 (이 workspace)
+        self.checkpoint_path = checkpoint_path or f"backfill_checkpoint_{workspace}.json"
+        self.metrics = RunMetrics()
+        self.rate_limiter = BrazeRateLimiter(rate_limit_reserve, self.metrics)
+        self.circuit_breaker = BrazeCircuitBreaker(run_metrics=self.metrics)
+        self.cache = BrazeResponseCache(cache_path) if cache_path else None
+        self._lock = threading.Lock()
+        self._session = None
+        self._bq_client = None
+        self.set_run_date(run_date)
+
+    def set_run_date(self, run_date=None):
+        """
+        :param run_date: YYYY-MM-DD the run is for (the day the cron fires), default today
+        """
+        today = datetime.fromisoformat(run_date) if run_date else datetime.now()
+        self.today = datetime.strftime(today, '%Y-%m-%d')
+        self.yesterday = datetime.strftime(today - timedelta(1), '%Y-%m-%d')
+        self.tdb_yesterday = datetime.strftime(today - timedelta(2), '%Y-%m-%d')
+        self.yesterday4bq = datetime.strftime(today - timedelta(1), '_%Y%m%d')
+
+    def qualify(self, table_id):
+        """:return: project.dataset.table id of table_id (as written in bq_schemas.json) in this context's project"""
+        parts = table_id.split('.')
+        return '.'.join([self.gcp_project] + parts[-2:]) if len(parts) >= 2 else table_id
+
+    def get_session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'Authorization': 'Bearer ' + str(self.braze_token)})
+                self._session = session
+            return self._session
+
+    def get_bq_client(self):
+        with self._lock:
+            if self._bq_client is None:
+                if os.path.exists(self.credentials_path):
+                    self._bq_client = bigquery.Client(project=self.gcp_project,
+                                                      credentials=get_gcp_credentials(self.credentials_path))
+                else:   # application default credentials (GCE/Cloud Run 서비스 계정)
+                    self._bq_client = bigquery.Client(project=self.gcp_project)
+                _client_metrics[self._bq_client] = self.metrics     # 이 client 로 돌린 job 은 이 workspace 의 metrics 로
+            return self._bq_client
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+            if self.cache is not None:
+                self.cache.close()
+
+
+class _ModuleRunContext(RunContext):
+    """RunContext reading the module globals (BRAZE_URL, braze_rate_limiter, braze_cache, get_bq_client(), ...)."""
+
+    braze_url = property(lambda self: BRAZE_URL)
+    braze_token = property(lambda self: BRAZE_TOKEN)
+    gcp_project = property(lambda self: GCP_PROJECT)
+    credentials_path = property(lambda self: GOOGLE_APPLICATION_CREDENTIALS)
+    ga_sessions_dataset = property(lambda self: GA_SESSIONS_DATASET)
+    rate_limiter = property(lambda self: braze_rate_limiter)
+    circuit_breaker = property(lambda self: braze_circuit_breaker)
+    cache = property(lambda self: braze_cache)
+    metrics = property(lambda self: metrics)
+
+    def __init__(self):
+        self.workspace = 'default'
+        self.max_workers = BRAZE_MAX_WORKERS
+        self.max_days = BACKFILL_MAX_WORKERS
+        self.checkpoint_path = BACKFILL_CHECKPOINT_PATH
+        self.today, self.yesterday, self.tdb_yesterday, self.yesterday4bq = TODAY, YESTERDAY, TDB_YESTERDAY, YESTERDAY4BQ
+
+    def set_run_date(self, run_date=None):
+        raise TypeError("the module context keeps the import-time dates, use RunContext(run_date=...)")
+
+    def get_session(self):
+        return get_braze_session()
+
+    def get_bq_client(self):
+        return get_bq_client()
+
+    def close(self):
+        pass
+
+
+_default_context = None
+
+
+def default_context():
+    """:return: the RunContext of the module globals, used when a function gets ctx=None"""
+    global _default_context
+    if _default_context is None:
+        _default_context = _ModuleRunContext()
+    return _default_context
+
+
+def _parse_streamed_response(response, stream_parser, run_metrics):
+    try:
+        response.raw.decode_content = True    # gzip 은 urllib3 가 풀어서 넘김
+        result = stream_parser(response.raw)
+        run_metrics.incr('braze_response_bytes', response.raw.tell())
+        return result
+    finally:
+        response.close()
+
+
+def braze_get(endpoint, params=None, ctx=None, stream_parser=None):
+    """
+    :param endpoint: Braze REST endpoint path, e.g. '/campaigns/details'
+    :param ctx: RunContext of the workspace to call, default_context() when None
+    :param stream_parser: called with the (decoded) response body as a file object instead of response.json(),
+                          so the body is never held in memory. Its JSON serializable result is what gets returned
+                          and cached, under endpoint + BRAZE_COMPACT_CACHE_SUFFIX
+    :return: decoded JSON response, or the result of stream_parser
+    """
+    ctx = ctx or default_context()
+    rate_limiter = ctx.rate_limiter
+    circuit_breaker = ctx.circuit_breaker
+    run_metrics = ctx.metrics
+    cache = ctx.cache if endpoint in BRAZE_CACHEABLE_ENDPOINTS else None
+    cache_endpoint = endpoint + BRAZE_COMPACT_CACHE_SUFFIX if stream_parser is not None else endpoint
+    if cache is not None:
+        cached = cache.get(cache_endpoint, params)
+        if cached is not None:
+            run_metrics.incr('braze_cache_hits')
+            return cached
+
+    for attempt in range(BRAZE_MAX_RETRIES + 1):
+        circuit_breaker.wait()
+        rate_limiter.wait()
+        run_metrics.incr('braze_requests')
+        try:
+            with run_metrics.timer('braze_request'):
+                response = ctx.get_session().get(ctx.braze_url + endpoint, params=params, timeout=BRAZE_TIMEOUT,
+                                                 stream=stream_parser is not None)
+                if stream_parser is not None and response.ok:
+                    result = _parse_streamed_response(response, stream_parser, run_metrics)
+        except (requests.ConnectionError, requests.Timeout, ProtocolError, ReadTimeoutError) as e:
+            run_metrics.incr('braze_connection_errors')
+            circuit_breaker.record_failure()
+            if attempt == BRAZE_MAX_RETRIES:
+                raise BrazeAPIError(endpoint, cause=e) from e
+            delay = backoff_delay(attempt)
+            logger.warning('Braze %s %r, retry %d in %.1fs', endpoint, e, attempt + 1, delay)
+        else:
+            run_metrics.incr(f'braze_http_{response.status_code}')
+            if stream_parser is None or not response.ok:
+                run_metrics.incr('braze_response_bytes', len(response.content))
+            rate_limiter.update(response.headers)
+            if response.ok:
+                circuit_breaker.record_success()
+                if stream_parser is None:
+                    result = response.json()
+                if cache is not None:
+                    cache.put(cache_endpoint, params, result)
+                return result
+            if response.status_code not in BRAZE_RETRY_STATUSES or attempt == BRAZE_MAX_RETRIES:
+                raise BrazeAPIError(endpoint, response.status_code, response.text[:500])
+            delay = retry_after_seconds(response.headers)
+            if response.status_code == 429:
+                # 한 worker가 throttle 당하면 나머지도 곧 당함. 다 같이 멈춤
+                circuit_breaker.trip(delay if delay is not None else backoff_delay(attempt))
+                delay = 0
+            else:
+                circuit_breaker.record_failure()
+                if delay is None:
+                    delay = backoff_delay(attempt)
+            logger.warning('Braze %s HTTP %d, retry %d', endpoint, response.status_code, attempt + 1)
+        run_metrics.incr('braze_retries')
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch_campaign_details(campaign_ids, max_workers=None, ctx=None):
+    """
+    Calls /campaigns/details for every id on a bounded worker pool (max_workers, default ctx.max_workers).
+    :return: list of raw detail responses, in the same order as campaign_ids
+    """
+    ctx = ctx or default_context()
+    campaign_ids = list(campaign_ids)
+    if not campaign_ids:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers or ctx.max_workers, len(campaign_ids))) as executor:
+        return list(executor.map(
+            lambda campaign_id: braze_get('/campaigns/details', {'campaign_id': campaign_id}, ctx), campaign_ids))
+
+
+# /campaigns/details 중 저장하는 필드. messages 는 본문이 커서 갯수만, conversion_behaviors 는 사용 안 함
+CAMPAIGN_DETAIL_FIELDS = ('name', 'description', 'created_at', 'updated_at', 'first_sent', 'last_sent', 'archived',
+                          'draft', 'enabled', 'schedule_type', 'channels', 'tags', 'teams')
+CampaignDetail = namedtuple('CampaignDetail', ('id',) + CAMPAIGN_DETAIL_FIELDS + ('messages',),
+                            defaults=(None,) * (len(CAMPAIGN_DETAIL_FIELDS) + 1))
+_JSON_VALUE_START_EVENTS = ('start_map', 'start_array', 'null', 'boolean', 'integer', 'double', 'number', 'string')
+
+
+def compact_campaign_detail(result):
+    """
+    :param result: decoded /campaigns/details response
+    :return: dict of CAMPAIGN_DETAIL_FIELDS and 'messages' (number of messages)
+    """
+    detail = {field: result[field] for field in CAMPAIGN_DETAIL_FIELDS if field in result}
+    detail['messages'] = len(result.get('messages') or ())
+    return detail
+
+
+def parse_campaign_detail_stream(fp):
+    """
+    Incremental form of compact_campaign_detail(json.load(fp)) with ijson: only CAMPAIGN_DETAIL_FIELDS are built,
+    messages are counted from the parser events, so memory does not grow with the message bodies.
+    Without ijson the response is decoded whole and compacted right away.
+    :return: dict of CAMPAIGN_DETAIL_FIELDS and 'messages' (number of messages)
+    """
+    if ijson is None:
+        return compact_campaign_detail(json.load(fp))
+    detail = {}
+    messages = 0
+    key = builder = None
+    for prefix, event, value in ijson.parse(fp, use_float=True):
+        if not prefix:
+            if event == 'map_key':
+                key = value
+        elif key == 'messages':
+            # messages: {message_variation_id: {...}} (또는 list). 최상위 항목 수만 셈
+            if (prefix == 'messages' and event == 'map_key') or \
+                    (prefix == 'messages.item' and event in _JSON_VALUE_START_EVENTS):
+                messages += 1
+        elif key in CAMPAIGN_DETAIL_FIELDS:
+            if builder is None:
+                builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            if prefix == key and event not in ('start_map', 'start_array'):     # 값(또는 list/dict)이 끝남
+                detail[key] = builder.value
+                builder = None
+    detail['messages'] = messages
+    return detail
+
+
+def fetch_campaign_detail(campaign_id, ctx=None):
+    """
+    :return: CampaignDetail of one campaign, parsed from the streamed /campaigns/details response
+    """
+    detail = braze_get('/campaigns/details', {'campaign_id': campaign_id}, ctx,
+                       stream_parser=parse_campaign_detail_stream)
+    return CampaignDetail(campaign_id, *(detail.get(field) for field in CampaignDetail._fields[1:]))
+
+
+def iter_campaign_details(campaign_ids, max_workers=None, ctx=None):
+    """
+    Streaming form of fetch_campaign_details: yields one CampaignDetail per id, in the same order as campaign_ids,
+    with at most 2 * max_workers (default ctx.max_workers) requests in flight or waiting to be consumed.
+    Memory stays flat whatever the number of campaigns or the size of their messages.
+    """
+    ctx = ctx or default_context()
+    max_workers = max_workers or ctx.max_workers
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    try:
+        for campaign_id in campaign_ids:
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fetch_campaign_detail, campaign_id, ctx))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_campaign_list(params=None, prefetch=BRAZE_PAGE_PREFETCH, ctx=None):
+    """
+    Pages through /campaigns/list, keeping up to `prefetch` page requests in flight.
+    Campaigns are yielded as soon as their page arrives; paging stops at the first empty page.
+    :param params: extra query parameters, e.g. {'last_edit.time[gt]': '2021-08-20T15:00:00'}
+    :return: generator of campaign info (id, name, is_api_campaign, tags, last_edited)
+    """
+    def fetch_page(page):
+        return braze_get('/campaigns/list', dict(params or {}, page=page), ctx)
+
+    executor = ThreadPoolExecutor(max_workers=max(prefetch, 1))
+    try:
+        pending = [executor.submit(fetch_page, page) for page in range(max(prefetch, 1))]
+        next_page = len(pending)
+        while pending:
+            result = pending.pop(0).result()
+            campaigns = result.get('campaigns')
+            if not campaigns:
+                break
+            pending.append(executor.submit(fetch_page, next_page))
             next_page += 1
-            response = requests.get(url + str(next_page), headers=HEADER)
-            result = response.json()
+            yield from campaigns
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
 
-    print("\n", len(campaigns), campaigns)
+def get_all_campaign_list(prefetch=BRAZE_PAGE_PREFETCH, ctx=None):
+    """
+    :return: list of all campaigns info (id, name, is_api_campaign, tags, last_edited)
+    """
+    # 처음에만 전체 리스트 가져와서 빅쿼리 테이블에 저장. 그 이후에는 하루 전에 생성된 캠페인 있는지 get_updated_campaign_list()
+    print("Getting all campaigns in braze...")
+    campaigns = list(iter_campaign_list(prefetch=prefetch, ctx=ctx))
+    print("\n", len(campaigns), "campaigns")
+    logger.debug("campaigns: %s", campaigns)
     return campaigns
 
 
-def get_updated_campaign_list(requested_date=TDB_YESTERDAY):
+def iter_updated_campaign_list(requested_date=None, prefetch=BRAZE_PAGE_PREFETCH, ctx=None):
     # 지금 22일 오후 10시. 어제 업데이트된 캠페인의 리스트를 알고싶다. 21일 데이터 = 2021-08-20T15:00:00 ~ 2021-08-21T15:00:00
+    requested_date = requested_date or (ctx or default_context()).tdb_yesterday
+    if isinstance(requested_date, str):
+        requested_date = datetime.fromisoformat(requested_date)
     tbd_date = datetime.strftime(requested_date - timedelta(days=2), '%Y-%m-%d')
-    url = 'https://rest.iad-06.braze.com/campaigns/list?&page='
-    response = requests.get(url+str(0)+'&last_edit.time[gt]='+tbd_date+'T15:00:00', headers=HEADER) #  이 시간 이후부터 지금까지 수정된 캠페인 리스트 조회
-    result = response.json()
-    # print(type(result), result)
-    print("Getting updated campaigns in braze.", end="")
-    updated_campaigns = []
-    if 'campaigns' in result:
-        next_page = 0
-        while len(result['campaigns']) != 0:
-            updated_campaigns.extend(result['campaigns'])
-            print("...", end="")
-            next_page += 1
-            response = requests.get(url+str(next_page)+'&last_edit.time[gt]='+tbd_date+'T15:00:00', headers=HEADER)
-            result = response.json()
+    #  이 시간 이후부터 지금까지 수정된 캠페인 리스트 조회
+    return iter_campaign_list({'last_edit.time[gt]': tbd_date + 'T15:00:00'}, prefetch=prefetch, ctx=ctx)
+
 
-    print("\n", len(updated_campaigns), updated_campaigns)
+def get_updated_campaign_list(requested_date=None, prefetch=BRAZE_PAGE_PREFETCH, ctx=None):
+    print("Getting updated campaigns in braze...")
+    updated_campaigns = list(iter_updated_campaign_list(requested_date, prefetch=prefetch, ctx=ctx))
+    print("\n", len(updated_campaigns), "updated campaigns")
+    logger.debug("updated campaigns: %s", updated_campaigns)
     return updated_campaigns
 
 
-def get_campaign_details(campaigns):
-    url = 'https://rest.iad-06.braze.com/campaigns/details'
+def get_campaign_details(campaigns, ctx=None):
     print("\nGetting campaigns details...")
+    campaign_ids = [campaign['id'] for campaign in campaigns if campaign['id']]
     campaigns_detail = []
-    for campaign in campaigns:
-        if campaign['id']:
-            response = requests.get(url=url+'?campaign_id='+campaign['id'], headers=HEADER)
-            result = response.json()
-            # print(result)
-
-            details_dict = {'id': campaign['id']}
-            for key, val in result.items():
-                details_dict[key] = val
-                details_dict['messages'] = len(result['messages'])   # messages의 내용 양이 많아서 생략, 갯수만 받아
-                # if result.get('channels'):
-                #     if any(ch in ['android_push', 'ios_push'] for ch in result['channels']):
-                #         details_dict['messages'] = result['messages']
-                #     else:
-                #         details_dict['messages'] = ''
-            del details_dict['message']
-            campaigns_detail.append(details_dict)
-            # print(details_dict)
-
-    print(len(campaigns_detail), campaigns_detail)
+    for detail in iter_campaign_details(campaign_ids, ctx=ctx):
+        # messages의 내용 양이 많아서 생략, 갯수만 받아 (CampaignDetail.messages)
+        campaigns_detail.append(detail._asdict())
+        logger.debug("%s", detail)
+
+    print(len(campaigns_detail), "campaigns details")
     return campaigns_detail
 
 
-def get_campaign_details_from_ids(campaign_ids):
-    url = 'https://rest.iad-06.braze.com/campaigns/details'
+def get_campaign_details_from_ids(campaign_ids, ctx=None):
     print("\nGetting campaigns details...")
     campaigns_detail = []
-    for campaign_id in campaign_ids:
-        response = requests.get(url=url+'?campaign_id='+campaign_id, headers=HEADER)
-        result = response.json()
-        # print(result)
+    for detail in iter_campaign_details(campaign_ids, ctx=ctx):
+        campaigns_detail.append(detail._asdict())
+        logger.debug("%s", detail)
 
-        details_dict = {'id': campaign_id}
-        for key, val in result.items():
-            details_dict[key] = val
-            details_dict['messages'] = len(result['messages'])   # messages의 내용 양이 많아서 생략, 갯수만 받아
+    print(len(campaigns_detail), "campaigns details")
+    return campaigns_detail
 
-        del details_dict['message']
-        campaigns_detail.append(details_dict)
-        print(details_dict)
 
-    print(len(campaigns_detail), campaigns_detail)
-    return campaigns_detail
+def _state_time(value):
+    """:return: value (Braze timestamp string or datetime) as a naive UTC 'YYYY-MM-DDTHH:MM:SS' string, or None"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime('%Y-%m-%dT%H:%M:%S')
+    parsed = parse_braze_timestamp(value)
+    return parsed.strftime('%Y-%m-%dT%H:%M:%S') if parsed is not None else None
+
+
+def detail_hash(result):
+    """:return: hash of a /campaigns/details response, to tell whether a refetched detail actually changed"""
+    return hashlib.sha1(json.dumps(result, sort_keys=True, default=str).encode('utf-8')).hexdigest()
 
 
-def get_latest_campaign_details_from_ids(campaign_ids):
+class CampaignStateIndex:
+    """
+    Local (SQLite) per-campaign state: name and last_edited from the list API / campaigns_list, and last_sent,
+    channels, archived/draft/enabled and a detail hash from the last /campaigns/details snapshot.
+    needs_refresh() tells which campaigns can have a new detail since that snapshot, so the daily detail calls
+    scale with the active campaigns instead of every campaign ever created.
+    """
+
+    def __init__(self, path=CAMPAIGN_STATE_PATH):
+        self.path = path
+        self.stats = {'refresh': 0, 'skipped': 0, 'changed': 0, 'no_data': 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS campaign_state (
+                                id TEXT PRIMARY KEY,
+                                name TEXT,
+                                last_edited TEXT,
+                                last_sent TEXT,
+                                channels TEXT,
+                                archived INTEGER,
+                                draft INTEGER,
+                                enabled INTEGER,
+                                detail_hash TEXT,
+                                detail_edited TEXT,
+                                detail_fetched_at TEXT)""")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM campaign_state").fetchone()[0]
+
+    def update_from_list(self, campaigns):
+        """
+        :param campaigns: entries of /campaigns/list or campaigns_list rows (id, name, last_edited[, last_sent])
+        """
+        rows = [(campaign['id'], campaign.get('name'), _state_time(campaign.get('last_edited')),
+                 _state_time(campaign.get('last_sent'))) for campaign in campaigns]
+        with self._lock:
+            self._conn.executemany("""INSERT INTO campaign_state (id, name, last_edited, last_sent) VALUES (?, ?, ?, ?)
+                                      ON CONFLICT(id) DO UPDATE SET
+                                        name = COALESCE(excluded.name, name),
+                                        last_edited = MAX(COALESCE(excluded.last_edited, ''), COALESCE(last_edited, '')),
+                                        last_sent = COALESCE(last_sent, excluded.last_sent)""", rows)
+            self._conn.commit()
+
+    def seed_from_bq(self, client: bigquery.Client, target_table_id=None):
+        """
+        Seeds the index from campaigns_list (one row per campaign, latest last_edited/last_sent).
+        Nothing keeps campaigns_list.last_sent current, so the seed never makes may_have_data skip a campaign.
+        """
+        target_table_id = target_table_id or TABLE_CAMPAIGNS_LIST
+        print(f"\nSeeding campaign state index from bq table: {target_table_id}")
+        rows = run_query(client, SELECT_CAMPAIGN_STATES_SQL.format(table=f"{client.project}.{target_table_id}"))
+        self.update_from_list(dict(row.items()) for row in rows)
+        print(f"{len(self)} campaigns in the state index")
+
+    def record_detail(self, campaign_id, result):
+        """
+        Stores the snapshot of a /campaigns/details response (or CampaignDetail._asdict(), where a field the
+        response did not have is None: enabled=None counts as enabled).
+        :return: True when the detail differs from the previous snapshot
+        """
+        digest = detail_hash(result)
+        now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+        with self._lock:
+            row = self._conn.execute("SELECT detail_hash, last_edited FROM campaign_state WHERE id = ?",
+                                     (campaign_id,)).fetchone()
+            # 스냅샷 시점의 수정 시각: list의 last_edited 와 디테일의 updated_at 중 늦은 쪽
+            last_edited = max((row[1] if row is not None else None) or '', _state_time(result.get('updated_at')) or '')
+            last_edited = last_edited or None
+            self._conn.execute("""INSERT OR REPLACE INTO campaign_state (id, name, last_edited, last_sent, channels,
+                                                                       archived, draft, enabled, detail_hash,
+                                                                       detail_edited, detail_fetched_at)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                               (campaign_id, result.get('name'), last_edited, _state_time(result.get('last_sent')),
+                                json.dumps(result.get('channels') or []), int(bool(result.get('archived'))),
+                                int(bool(result.get('draft'))), int(result.get('enabled') is not False), digest,
+                                last_edited, now))
+            self._conn.commit()
+            changed = row is None or row[0] != digest
+            if changed:
+                self.stats['changed'] += 1
+        return changed
+
+    def _state(self, campaign_id):
+        with self._lock:
+            return self._conn.execute("""SELECT name, last_edited, last_sent, archived, draft, enabled,
+                                                detail_hash, detail_edited, detail_fetched_at
+                                         FROM campaign_state WHERE id = ?""", (campaign_id,)).fetchone()
+
+    def needs_refresh(self, campaign_id, day=None):
+        """
+        :param day: YYYY-MM-DD (KST) whose sends are being looked for, default default_context().yesterday
+        :return: False only when the last snapshot is still current (not edited since) and the campaign cannot
+                 have sent since: archived/draft/disabled, or a one-off campaign already sent whose date (YYMMDD_ of
+                 its name) is before day. A campaign only seeded from campaigns_list uses its last_sent as snapshot.
+        """
+        day = day or default_context().yesterday
+        state = self._state(campaign_id)
+        refresh = True
+        if state is not None:
+            name, last_edited, last_sent, archived, draft, enabled, digest, detail_edited, _ = state
+            # 디테일 스냅샷이 없으면(campaigns_list 로 seed 만 된 경우) 마지막 발송 시점을 스냅샷으로 봄
+            snapshot_edited = detail_edited if digest is not None else last_sent
+            if snapshot_edited is not None and (last_edited or '') <= snapshot_edited:    # 스냅샷 이후 수정 없음
+                oneoff_prefix = parse_campaign_name(name or '').oneoff_date_prefix
+                if archived or draft or enabled == 0:
+                    refresh = False
+                elif oneoff_prefix is not None and last_sent is not None and oneoff_prefix < oneoff_date_prefix(day):
+                    refresh = False
+        with self._lock:
+            self.stats['refresh' if refresh else 'skipped'] += 1
+        return refresh
+
+    def may_have_data(self, campaign_id, day):
+        """
+        :return: False when a /campaigns/details snapshot (record_detail) taken after the KST day shows the campaign
+                 had not sent by then (no last_sent, or last_sent before the day started), so its analytics of that
+                 day are empty. State only seeded from campaigns_list or the list API always returns True.
+        """
+        state = self._state(campaign_id)
+        if state is None or state[6] is None:
+            return True
+        last_sent, detail_fetched_at = state[2], state[8]
+        start, end = kst_day_window(day)
+        if detail_fetched_at < end.strftime('%Y-%m-%dT%H:%M:%S'):
+            return True
+        if last_sent is not None and last_sent >= start.strftime('%Y-%m-%dT%H:%M:%S'):
+            return True
+        with self._lock:
+            self.stats['no_data'] += 1
+        return False
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def get_latest_campaign_details_from_ids(campaign_ids, state_index: CampaignStateIndex = None, ctx=None):
     # 지금 22일 오후 10시. 어제 21일 업데이트된 캠페인의 디테일 알고싶다. 21일 데이터 = 2021-08-20T15:00:00 ~ 2021-08-21T15:00:00
-    url = 'https://rest.iad-06.braze.com/campaigns/details'
     print("\nGetting campaigns details...")
+    ctx = ctx or default_context()
+    campaign_ids = list(campaign_ids)
+    if state_index is not None:
+        # 스냅샷 이후 바뀔 수 없는 캠페인(보관/초안/비활성, 이미 발송된 지난 일회성 캠페인)은 디테일 호출 생략
+        all_ids = len(campaign_ids)
+        campaign_ids = [campaign_id for campaign_id in campaign_ids
+                        if state_index.needs_refresh(campaign_id, ctx.yesterday)]
+        print(f"{len(campaign_ids)} of {all_ids} campaigns need a detail refresh")
     campaigns_detail = {}
-    for campaign_id in campaign_ids:
-        response = requests.get(url=url+'?campaign_id='+campaign_id, headers=HEADER)
-        result = response.json()
-        # print(result)
-        if result['last_sent']:
-            last_sent_time = None
-            if re.match('\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}$', result['last_sent'][:-6]):
-                last_sent_time = datetime.strptime(result['last_sent'][:-6], "%Y-%m-%dT%H:%M:%S")
-            elif re.match('\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z', result['last_sent']):
-                last_sent_time = datetime.strptime(result['last_sent'][:-1], "%Y-%m-%dT%H:%M:%S")
+    yesterday_strt, yesterday_end = kst_day_window(ctx.yesterday)   # TDB_YESTERDAY 15시 ~ YESTERDAY 15시 (UTC)
+    for detail in iter_campaign_details(campaign_ids, ctx=ctx):
+        result = detail._asdict()
+        if state_index is not None:
+            state_index.record_detail(detail.id, result)
+        if detail.last_sent:
+            last_sent_time = parse_braze_timestamp(detail.last_sent)
 
             if last_sent_time is not None:
-                yesterday_strt = datetime.strptime(TDB_YESTERDAY+'T15:00:00', "%Y-%m-%dT%H:%M:%S") #TDB_YESTERDAY
-                yesterday_end = datetime.strptime(YESTERDAY+'T15:00:00', "%Y-%m-%dT%H:%M:%S")
                 if yesterday_strt < last_sent_time < yesterday_end:
                     print(f"sent yesterday ({last_sent_time})")
-                    details = {'id': campaign_id}
-                    for key, val in result.items():
-                        details[key] = val
-                    details['messages'] = len(result['messages'])   # messages의 내용 양이 많아서 생략, 갯수만 받아
-                    del details['conversion_behaviors']
+                    details = result
                     del details['archived']
                     del details['draft']
-                    del details['message']
-                    print(details)
+                    logger.debug("%s", details)
 
-                    if any(ch in ['android_push', 'ios_push'] for ch in result['channels']):
-                        campaigns_ch = 'push'
-                    elif any(ch in ['trigger_in_app_message'] for ch in result['channels']):
-                        campaigns_ch = 'inappmsg'
-                    else:
-                        campaigns_ch = result['channels'][0]
+                    campaigns_ch = channel_family(detail.channels)   # push / inappmsg / 그 외 첫 채널
 
                     try:
                         campaigns_detail[campaigns_ch].append(details)
@@ -179,92 +949,351 @@ def get_latest_campaign_details_from_ids(campaign_ids):
 
     print("all scanned")
     for channel in campaigns_detail:
-        print(f"{channel}:", len(campaigns_detail[channel]), campaigns_detail[channel])
+        print(f"{channel}:", len(campaigns_detail[channel]))
+        logger.debug("%s: %s", channel, campaigns_detail[channel])
     return campaigns_detail
 
 
+INSERT_CAMPAIGN_LIST_SQL = """INSERT INTO `{table}`
+                    (id, name, tags, last_edited, is_api_campaign)
+                    VALUES (@id, @name, @tags, @last_edited, @is_api_campaign)"""
+
+SELECT_ALL_IDS_SQL = """SELECT DISTINCT id FROM `{table}`"""
+
+SELECT_CAMPAIGN_STATES_SQL = """SELECT id, ANY_VALUE(name) AS name, MAX(last_edited) AS last_edited,
+                    MAX(last_sent) AS last_sent FROM `{table}` GROUP BY id"""
+
+SELECT_ALL_IDS_NAMES_SQL = """SELECT id, name FROM `{table}`"""
+
+SELECT_MISSING_IDS_SQL = """SELECT candidate_id
+                FROM UNNEST(@candidate_ids) AS candidate_id
+                WHERE candidate_id NOT IN (
+                    SELECT id FROM `{table}` WHERE id IS NOT NULL)"""
+
+SELECT_ONEOFF_CAMPAIGNS_SQL = """SELECT id, name FROM `{table}`
+                WHERE REGEXP_CONTAINS(name, r'^\\d{{6}}_')
+                AND SUBSTR(name, 1, 6) IN UNNEST(@date_prefixes)"""
+
+UPDATE_CAMPAIGN_DETAIL_SQL = """UPDATE `{table}` 
+                SET last_sent = (CASE 
+                    WHEN last_sent IS NULL THEN @last_sent
+                    WHEN last_sent < @last_sent THEN @last_sent
+                    ELSE last_sent END), 
+                updated_at = (CASE
+                    WHEN updated_at IS NULL THEN @updated_at
+                    WHEN updated_at < @updated_at THEN @updated_at
+                    ELSE updated_at END)
+                WHERE id = @id"""
+
+UPDATE_CAMPAIGN_LIST_SQL = """UPDATE `{table}` 
+                    SET name = @name,
+                    last_edited = @last_edited,
+                    tags = (CASE
+                        WHEN name != @name THEN ARRAY_CONCAT(tags, [CONCAT("Name changes: ", name)])
+                        ELSE tags END)
+                    WHERE id = @id"""
+
+
+def _query_parameter_type(value):
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, int):
+        return 'INT64'
+    if isinstance(value, float):
+        return 'FLOAT64'
+    if isinstance(value, datetime):
+        return 'TIMESTAMP'
+    if isinstance(value, date):
+        return 'DATE'
+    return 'STRING'
+
+
+def query_parameter(name, value, type_=None):
+    """
+    :param type_: BigQuery type of the value (of the elements for a list); inferred from the value when None
+    :return: ScalarQueryParameter, or ArrayQueryParameter for a list/tuple/set value
+    """
+    if isinstance(value, (list, tuple, set)):
+        values = list(value)
+        return bigquery.ArrayQueryParameter(name, type_ or _query_parameter_type(values[0] if values else ''), values)
+    return bigquery.ScalarQueryParameter(name, type_ or _query_parameter_type(value), value)
+
+
+def run_query(client: bigquery.Client, sql, params=None, types=None):
+    """
+    Runs sql with named query parameters (@name). Values never end up in the statement text, so each operation
+    always sends the same text (and can be served from BigQuery's cached results), and quotes or '$' in campaign
+    names cannot break the statement.
+    :param params: {name: value}; list values become ARRAY parameters
+    :param types: {name: BigQuery type} overriding the type inferred from the value, e.g. from table_column_types()
+    :return: RowIterator of the finished job (rows, num_dml_affected_rows)
+    """
+    types = types or {}
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[query_parameter(name, value, types.get(name)) for name, value in (params or {}).items()])
+    query_job = client.query(sql, job_config=job_config, retry=BQ_RETRY, job_retry=BQ_JOB_RETRY)
+    run_metrics = bq_metrics(client)
+    run_metrics.incr('bq_queries')
+    try:
+        return query_job.result()   # job_retry 로 다시 실행된 job 까지 기다림
+    finally:
+        _record_query_job(query_job, run_metrics)
+
+
+def _job_seconds(job):
+    if job.started is None or job.ended is None:
+        return None
+    return (job.ended - job.started).total_seconds()
+
+
+def _record_query_job(query_job, run_metrics):
+    """Metrics of a finished (or failed) run_query job: BigQuery run time and bytes processed/billed."""
+    if query_job.error_result:
+        run_metrics.incr('bq_query_errors')
+    seconds = _job_seconds(query_job)
+    if seconds is not None:
+        run_metrics.observe('bq_query', seconds)
+    run_metrics.incr('bq_bytes_processed', query_job.total_bytes_processed or 0)
+    run_metrics.incr('bq_bytes_billed', query_job.total_bytes_billed or 0)
+    if query_job.cache_hit:
+        run_metrics.incr('bq_query_cache_hits')
+
+
+def _record_load_job(load_job, run_metrics):
+    """Metrics of a finished (or failed) load job: BigQuery run time and rows written."""
+    if load_job.error_result:
+        run_metrics.incr('bq_load_errors')
+    seconds = _job_seconds(load_job)
+    if seconds is not None:
+        run_metrics.observe('bq_load_job', seconds)
+    run_metrics.incr('bq_rows_loaded', load_job.output_rows or 0)
+
+
+_table_column_types = {}
+_table_column_types_lock = threading.Lock()
+
+
+def table_column_types(client: bigquery.Client, table_id: str):
+    """
+    :return: {column name: BigQuery type} of a table, fetched once per process.
+             Used to type query parameters like the columns they are compared with or written to.
+    """
+    with _table_column_types_lock:
+        key = (client.project, table_id)
+        if key not in _table_column_types:
+            table = client.get_table(f"{client.project}.{table_id}")
+            _table_column_types[key] = {field.name: field.field_type for field in table.schema}
+        return _table_column_types[key]
+
+
 def insert_data_to_bq(client: bigquery.Client, data, destination_table_id: str):
     print("\nInserting data to bq table:", destination_table_id)
-    print("data", data)
+    logger.debug("data %s", data)
     try:
-        sql = f"""INSERT INTO `{GCP_PROJECT}.{destination_table_id}`
-                    (id, name, tags, last_edited, is_api_campaign)
-                    VALUES ("{data['id']}", "{data['name']}", {data['tags']}, "{data['last_edited']}", {data['is_api_campaign']})"""
-        query_job = client.query(sql)
-        result = query_job.result()
+        params = {column: data[column] for column in ('id', 'name', 'tags', 'last_edited', 'is_api_campaign')}
+        result = run_query(client, INSERT_CAMPAIGN_LIST_SQL.format(table=f"{client.project}.{destination_table_id}"),
+                           params, table_column_types(client, destination_table_id))
         print("result:", result)
     except NotFound:
         _handle_error()
         return
 
 
-def select_all_ids_from_bq(target_table_id: str):
-    client = connect_to_bq()
+def select_all_ids_from_bq(target_table_id: str, client: bigquery.Client = None):
+    """
+    :return: set of every id in the table, for O(1) membership checks
+    """
+    client = client or get_bq_client()
     print(f"\nGetting all ids from bq table: {target_table_id}")
     try:
-        sql = f"""SELECT id FROM `{GCP_PROJECT}.{target_table_id}`"""
-        query_job = client.query(sql)
-        rows = query_job.result()
+        rows = run_query(client, SELECT_ALL_IDS_SQL.format(table=f"{client.project}.{target_table_id}"))
     except NotFound:
-        return []
-    return [row[0] for row in rows]
+        return set()
+    return {row[0] for row in rows}
+
+
+def select_missing_ids_from_bq(client: bigquery.Client, target_table_id: str, candidate_ids):
+    """
+    Sends only the candidate ids to BigQuery instead of streaming the whole table back.
+    :return: set of candidate ids that are not in the table yet
+    """
+    candidate_ids = sorted(set(candidate_ids))  # 같은 후보면 같은 파라미터 -> 캐시된 결과 사용
+    print(f"\nChecking {len(candidate_ids)} ids against bq table: {target_table_id}")
+    if not candidate_ids:
+        return set()
+    try:
+        rows = run_query(client, SELECT_MISSING_IDS_SQL.format(table=f"{client.project}.{target_table_id}"),
+                         {'candidate_ids': candidate_ids}, {'candidate_ids': 'STRING'})
+    except NotFound:
+        return set(candidate_ids)
+    return {row[0] for row in rows}
 
 
 def select_all_ids_names_from_bq(client: bigquery.Client, target_table_id: str):
-    client = connect_to_bq()
+    client = client or get_bq_client()
     print(f"\nGetting all ids from bq table: {target_table_id}")
     try:
-        sql = f"""SELECT id, name FROM `{GCP_PROJECT}.{target_table_id}`"""
-        query_job = client.query(sql)
-        rows = query_job.result()
+        rows = run_query(client, SELECT_ALL_IDS_NAMES_SQL.format(table=f"{client.project}.{target_table_id}"))
     except NotFound:
         return []
     return [list(row.items()) for row in rows]
 
 
+def select_oneoff_campaigns_from_bq(client: bigquery.Client, target_table_id: str, dates, use_arrow=True):
+    """
+    One-off campaigns (name starting with YYMMDD_) of the given dates, filtered in BigQuery instead of in Python.
+    With pyarrow installed the result is read as Arrow through the BigQuery Storage Read API when available
+    (google-cloud-bigquery-storage), otherwise through the REST pager.
+    :param dates: list of YYYY-MM-DD
+    :return: columnar batch {'id': [...], 'name': [...]}
+    """
+    date_prefixes = sorted({oneoff_date_prefix(day) for day in dates})
+    print(f"\nGetting one-off campaigns {date_prefixes} from bq table: {target_table_id}")
+    try:
+        rows = run_query(client, SELECT_ONEOFF_CAMPAIGNS_SQL.format(table=f"{client.project}.{target_table_id}"),
+                         {'date_prefixes': date_prefixes}, {'date_prefixes': 'STRING'})
+    except NotFound:
+        return {'id': [], 'name': []}
+    if use_arrow and pyarrow is not None:
+        return rows.to_arrow(create_bqstorage_client=True).to_pydict()
+    campaigns = {'id': [], 'name': []}
+    for row in rows:
+        campaigns['id'].append(row[0])
+        campaigns['name'].append(row[1])
+    return campaigns
+
+
 def update_detail_data_to_bq(client: bigquery.Client, data, destination_table_id: str):
     print("\nUpdating data to bq table:", destination_table_id)
-    print("data", data)
-    sql = f"""UPDATE `{GCP_PROJECT}.{destination_table_id}` 
-                SET last_sent = (CASE 
-                    WHEN last_sent IS NULL THEN "{data['last_sent']}"
-                    WHEN last_sent<"{data['last_sent']}" THEN "{data['last_sent']}"
-                    ELSE last_sent END), 
-                updated_at = (CASE
-                    WHEN updated_at IS NULL THEN "{data['updated_at']}"
-                    WHEN updated_at<"{data['updated_at']}" THEN "{data['updated_at']}"
-                    ELSE updated_at END)
-                WHERE id="{data['id']}" """
-    query_job = client.query(sql)
-    result = query_job.result()
+    logger.debug("data %s", data)
+    params = {column: data[column] for column in ('id', 'last_sent', 'updated_at')}
+    result = run_query(client, UPDATE_CAMPAIGN_DETAIL_SQL.format(table=f"{client.project}.{destination_table_id}"),
+                       params, table_column_types(client, destination_table_id))
     print("result:", result)
 
 
 def update_list_data_to_bq(client: bigquery.client, data, destination_table_id: str):
     print("\nUpdating list data to bq table:", destination_table_id)
-    print("data", data)
-    sql = f"""UPDATE `{GCP_PROJECT}.{destination_table_id}` 
-                    SET name = "{data['name']}",
-                    last_edited = "{data['last_edited']}",
-                    tags = (CASE
-                        WHEN name != "{data['name']}" THEN ARRAY_CONCAT(tags, [CONCAT("Name changes: ", name)])
-                        ELSE tags END)
-                    WHERE id="{data['id']}" """
-    query_job = client.query(sql)
-    result = query_job.result()
+    logger.debug("data %s", data)
+    params = {column: data[column] for column in ('id', 'name', 'last_edited')}
+    result = run_query(client, UPDATE_CAMPAIGN_LIST_SQL.format(table=f"{client.project}.{destination_table_id}"),
+                       params, table_column_types(client, destination_table_id))
     print("result:", result)
 
 
-def get_campaign_analytics(campaigns):
-    url = 'https://rest.iad-06.braze.com/campaigns/data_series'
+CAMPAIGN_LIST_COLUMNS = ('id', 'name', 'tags', 'last_edited', 'is_api_campaign')
+CAMPAIGN_DETAIL_COLUMNS = ('id', 'last_sent', 'updated_at')
+STAGING_TABLE_EXPIRATION = timedelta(hours=6)    # 정리 못 한 staging 테이블도 결국 자동 삭제
+
+MERGE_CAMPAIGN_LIST_SQL = """MERGE `{target}` T
+                USING `{staging}` S
+                ON T.id = S.id
+                WHEN MATCHED THEN UPDATE SET
+                    name = S.name,
+                    last_edited = S.last_edited,
+                    tags = (CASE
+                        WHEN T.name != S.name THEN ARRAY_CONCAT(T.tags, [CONCAT("Name changes: ", T.name)])
+                        ELSE T.tags END)
+                WHEN NOT MATCHED THEN
+                    INSERT (id, name, tags, last_edited, is_api_campaign)
+                    VALUES (S.id, S.name, S.tags, S.last_edited, S.is_api_campaign)"""
+
+MERGE_CAMPAIGN_DETAIL_SQL = """MERGE `{target}` T
+                USING `{staging}` S
+                ON T.id = S.id
+                WHEN MATCHED THEN UPDATE SET
+                    last_sent = (CASE
+                        WHEN T.last_sent IS NULL THEN S.last_sent
+                        WHEN T.last_sent < S.last_sent THEN S.last_sent
+                        ELSE T.last_sent END),
+                    updated_at = (CASE
+                        WHEN T.updated_at IS NULL THEN S.updated_at
+                        WHEN T.updated_at < S.updated_at THEN S.updated_at
+                        ELSE T.updated_at END)"""
+
+
+def _stage_rows_to_bq(client: bigquery.Client, rows, destination_table_id: str, columns):
+    """
+    Loads rows into a temporary staging table next to destination_table_id with one load job.
+    Column types are copied from the destination table so MERGE compares like with like.
+    :return: fully qualified staging table id
+    """
+    destination = client.get_table(f"{client.project}.{destination_table_id}")
+    schema = [field for field in destination.schema if field.name in columns]
+    staging_table = bigquery.Table(
+        f"{destination.project}.{destination.dataset_id}._staging_{destination.table_id}_{uuid.uuid4().hex}",
+        schema=schema)
+    staging_table.expires = datetime.utcnow() + STAGING_TABLE_EXPIRATION
+    staging_table = client.create_table(staging_table)
+    staging_table_id = f"{staging_table.project}.{staging_table.dataset_id}.{staging_table.table_id}"
+
+    job_config = bigquery.LoadJobConfig(schema=schema, write_disposition='WRITE_APPEND')
+    load_job = client.load_table_from_json([{field.name: row.get(field.name) for field in schema} for row in rows],
+                                           staging_table_id, job_config=job_config)
+    run_metrics = bq_metrics(client)
+    run_metrics.incr('bq_load_jobs')
+    try:
+        load_job.result()
+    finally:
+        _record_load_job(load_job, run_metrics)
+    return staging_table_id
+
+
+def _merge_staged_rows(client: bigquery.Client, rows, destination_table_id: str, columns, merge_sql):
+    staging_table_id = _stage_rows_to_bq(client, rows, destination_table_id, columns)
+    try:
+        result = run_query(client, merge_sql.format(target=f"{client.project}.{destination_table_id}",
+                                                    staging=staging_table_id))
+        print("merged rows:", result.num_dml_affected_rows)
+    finally:
+        client.delete_table(staging_table_id, not_found_ok=True)
+
+
+def sync_campaign_list_to_bq(client: bigquery.Client, campaigns, destination_table_id: str):
+    """
+    Batched form of insert_data_to_bq / update_list_data_to_bq: new campaigns are inserted, existing ones get
+    the new name and last_edited, and a name change is appended to tags.
+    """
+    latest = {}
+    for campaign in campaigns:
+        latest[campaign['id']] = campaign    # MERGE는 id당 한 줄만 허용. 마지막 값 사용
+    print(f"\nSyncing {len(latest)} campaigns to bq table:", destination_table_id)
+    if not latest:
+        return
+    _merge_staged_rows(client, latest.values(), destination_table_id, CAMPAIGN_LIST_COLUMNS, MERGE_CAMPAIGN_LIST_SQL)
+
+
+def sync_campaign_details_to_bq(client: bigquery.Client, details, destination_table_id: str):
+    """
+    Batched form of update_detail_data_to_bq: last_sent and updated_at only ever move forward.
+    :param details: detail dicts or CampaignDetail records, e.g. iter_campaign_details(ids) streamed straight in
+    """
+    latest = {}
+    for data in details:
+        if isinstance(data, CampaignDetail):
+            data = data._asdict()
+        row = latest.setdefault(data['id'], {'id': data['id'], 'last_sent': None, 'updated_at': None})
+        for column in ('last_sent', 'updated_at'):
+            if data.get(column) and (row[column] is None or row[column] < data[column]):
+                row[column] = data[column]
+    print(f"\nSyncing {len(latest)} campaign details to bq table:", destination_table_id)
+    if not latest:
+        return
+    _merge_staged_rows(client, latest.values(), destination_table_id, CAMPAIGN_DETAIL_COLUMNS,
+                       MERGE_CAMPAIGN_DETAIL_SQL)
+
+
+def get_campaign_analytics(campaigns, ctx=None):
     print("-----------------------analytics---------------------------")
+    ctx = ctx or default_context()
     campaigns_analytics = []
     for campaign in campaigns:
         if campaign['id']:
-            response = requests.get(url=url+'?campaign_id='+campaign['id']+'&length=1&ending_at='+TDB_YESTERDAY+'T15:00:00', headers=HEADER)
-            result = response.json()
+            result = braze_get('/campaigns/data_series',
+                               {'campaign_id': campaign['id'], 'length': 1, 'ending_at': ctx.tdb_yesterday+'T15:00:00'},
+                               ctx)
             # print("id: ", campaign['id'], ", name: ", campaign['name'])
-            print(result)
+            logger.debug("%s", result)
             msgs_dict = {'id': campaign['id'], 'name': campaign['name'], 'utm_source':campaign['name']}
             if result.get('data'):
                 morning_messages = result['data'][0]['messages']
@@ -311,23 +1340,23 @@ def get_campaign_analytics(campaigns):
                     continue
                     """
 
-            print(msgs_dict)
+            logger.debug("%s", msgs_dict)
             campaigns_analytics.append(msgs_dict)
 
     print(len(campaigns_analytics), "campaigns analytics!")
     return campaigns_analytics
 
 
-def get_campaign_analytics_from_id(ids):
+def get_campaign_analytics_from_id(ids, ctx=None):
     # 지금 22일 오후 10시. 어제 21일 업데이트된 캠페인의 분석 알고싶다. 21일 데이터 = 2021-08-20T15:00:00 ~ 2021-08-21T15:00:00
-    url = 'https://rest.iad-06.braze.com/campaigns/data_series'
     print("-----------------------analytics---------------------------")
+    ctx = ctx or default_context()
     campaigns_analytics = []
 
     for id in ids:
-        response = requests.get(url=url+'?campaign_id='+id+'&length=1&ending_at='+TDB_YESTERDAY, headers=HEADER)    # 지금 23일. 21일 데이터 알고싶어. TDB_YESTERDAY
-        result = response.json()
-        print(result)
+        result = braze_get('/campaigns/data_series', {'campaign_id': id, 'length': 1, 'ending_at': ctx.tdb_yesterday},
+                           ctx)    # 지금 23일. 21일 데이터 알고싶어. TDB_YESTERDAY
+        logger.debug("%s", result)
 
 
 def set_gcp_credentials():
@@ -339,10 +1368,11 @@ def set_gcp_credentials():
 def etl():
     print("Start!")
     try:
-        for table in bq_schema:
+        for table in get_bq_schema():
             table_id = table.get('id')
             table_schema = table.get('schema')
-            _check_if_table_exists(table_id, table_schema)   # check if table exists, otherwise create
+            # check if table exists, otherwise create
+            _check_if_table_exists(table_id, table_schema, table.get('time_partitioning'), table.get('clustering_fields'))
             # _load_table_from_result()
 
     except Exception:
@@ -354,28 +1384,82 @@ def _handle_error():
     print(message)
 
 
-def _check_if_table_exists(table_id, table_schema):
+def _check_if_table_exists(table_id, table_schema, time_partitioning=None, clustering_fields=None, client=None):
+    client = client or get_bq_client()
     try:
-        BQ.get_table(table_id)
+        client.get_table(table_id)
     except NotFound:
         logging.warn('Creating table: %s' % table_id)
-        schema = create_schema_from_json(table_schema)
-        table = bigquery.Table(table_id, schema=schema)
-        table = BQ.create_table(table)
+        table = create_table_from_json(table_id, table_schema, time_partitioning, clustering_fields)
+        table = client.create_table(table)
         print("Created table {}.{}.{}".format(table.project, table.dataset_id, table.table_id))
 
 
 def create_schema_from_json(table_schema):
     schema = []
     for column in table_schema:
-        schemaField = bigquery.SchemaField(column['name'], column['type'], column['mode'])
+        fields = create_schema_from_json(column['fields']) if column['type'] == 'RECORD' else ()
+        schemaField = bigquery.SchemaField(column['name'], column['type'], column['mode'], fields=fields)
         schema.append(schemaField)
-
-        if column['type'] == 'RECORD':
-            schemaField._fields = create_schema_from_json(column['fields'])
     return schema
 
 
+def create_table_from_json(table_id, table_schema, time_partitioning=None, clustering_fields=None):
+    """
+    :param time_partitioning: e.g. {"type": "DAY", "field": "date"} from bq_schemas.json
+    :param clustering_fields: e.g. ["id", "channel", "utm_campaign_source"] from bq_schemas.json
+    :return: bigquery.Table (not created yet) with the schema, partitioning and clustering applied
+    """
+    table = bigquery.Table(table_id, schema=create_schema_from_json(table_schema))
+    if time_partitioning:
+        table.time_partitioning = bigquery.TimePartitioning(type_=time_partitioning.get('type', 'DAY'),
+                                                            field=time_partitioning.get('field'))
+    if clustering_fields:
+        table.clustering_fields = clustering_fields
+    return table
+
+
+def migrate_table_to_partitioned(client: bigquery.Client, table_json, keep_backup=False):
+    """
+    Rewrites an existing unpartitioned table into the partitioned/clustered layout described in bq_schemas.json.
+    BigQuery cannot change the partitioning of a table in place, so {table}_partitioned is created from the json
+    (create_table_from_json) and filled with INSERT ... SELECT; only once every row is there is the old table
+    dropped (copied to {table}_migration_backup first with keep_backup) and the new one renamed to its name.
+    A failure before the swap leaves the original table untouched.
+    """
+    table_id = table_json['id']
+    time_partitioning = table_json.get('time_partitioning')
+    clustering_fields = table_json.get('clustering_fields')
+    if not time_partitioning:
+        print(f"No partitioning configured for {table_id}")
+        return
+    table = client.get_table(table_id)
+    if table.time_partitioning is not None:
+        print(f"Already partitioned: {table_id}")
+        return
+
+    partitioned_table_id = f"{table_id}_partitioned"
+    print(f"Migrating {table_id} to {time_partitioning} {clustering_fields or ''} through {partitioned_table_id}")
+    client.delete_table(partitioned_table_id, not_found_ok=True)     # 이전에 실패한 시도가 남긴 테이블
+    client.create_table(create_table_from_json(partitioned_table_id, table_json['schema'], time_partitioning,
+                                               clustering_fields))
+    columns = ', '.join(f"`{column['name']}`" for column in table_json['schema'])
+    run_query(client, f"""INSERT INTO `{partitioned_table_id}` ({columns})
+                SELECT {columns} FROM `{table_id}`""")
+
+    source_rows = client.get_table(table_id).num_rows
+    copied_rows = client.get_table(partitioned_table_id).num_rows
+    if copied_rows != source_rows:
+        raise RuntimeError(f"{partitioned_table_id} has {copied_rows} rows, {table_id} has {source_rows}. "
+                           f"{table_id} is left as it was")
+
+    if keep_backup:
+        client.copy_table(table_id, f"{table_id}_migration_backup").result()
+    client.delete_table(table_id)
+    run_query(client, f"ALTER TABLE `{partitioned_table_id}` RENAME TO `{table_id.split('.')[-1]}`")
+    print(f"Migrated table {table_id}")
+
+
 def _load_data_from_result(result):
     get_latest_campaign_details_from_ids()
 
@@ -390,228 +1474,355 @@ def load_table_from_analytics_result(client: bigquery.client, analytics, table_i
     print("Job finished.")
 
 
-def get_today_campaign_analytics_from_id_name(campaign_id_name, day):
-    url = 'https://rest.iad-06.braze.com/campaigns/data_series'
-    print(f"Getting campaigns analytics... for {day}")
-    id = campaign_id_name[0]
-    name = campaign_id_name[1]
+class AnalyticsStagingWriter:
+    """
+    Streams analytics rows of many campaigns into a newline-delimited JSON temp file and submits one load job per
+    file, instead of one load_table_from_json job per campaign. Rows go to disk as they are written, and the file
+    rolls over to a new load job once it reaches max_rows or max_bytes, so memory stays bounded.
+    Use as a context manager; leaving the block submits the last file and waits for every load job.
+    """
 
-    response = requests.get(url=url + '?campaign_id=' + id + '&length=1&ending_at=' + day, headers=HEADER)
-    result = response.json()
+    def __init__(self, client: bigquery.Client, table_id, table_schema,
+                 max_rows=STAGING_MAX_ROWS, max_bytes=STAGING_MAX_BYTES):
+        self.client = client
+        self.metrics = bq_metrics(client)
+        self.table_id = table_id
+        self.schema = create_schema_from_json(table_schema)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.jobs = []
+        self.total_rows = 0
+        self._file = None
+        self._rows = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+    def write_rows(self, rows):
+        with self._lock:
+            for row in rows:
+                line = (json.dumps(row, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+                if self._file is None:
+                    self._file = tempfile.TemporaryFile()
+                self._file.write(line)
+                self._rows += 1
+                self._bytes += len(line)
+                self.total_rows += 1
+                if self._rows >= self.max_rows or self._bytes >= self.max_bytes:
+                    self._submit()
+
+    def _submit(self):
+        if self._file is None:
+            return
+        job_config = bigquery.LoadJobConfig(schema=self.schema, write_disposition='WRITE_APPEND',
+                                            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON)
+        try:
+            self._file.seek(0)
+            with self.metrics.timer('bq_load_upload'):
+                load_job = self.client.load_table_from_file(self._file, self.table_id, job_config=job_config)
+        finally:
+            self._file.close()   # 업로드가 끝나면 파일은 필요 없음. job은 빅쿼리에서 계속 진행
+            self._file = None
+        print(f"Submitted load job {load_job.job_id}: {self._rows} rows, {self._bytes} bytes -> {self.table_id}")
+        self.metrics.incr('bq_load_jobs')
+        self.metrics.incr('bq_bytes_uploaded', self._bytes)
+        self.jobs.append(load_job)
+        self._rows = 0
+        self._bytes = 0
+
+    def _discard(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def flush(self):
+        """Submits the rows written so far as a load job, without waiting for it."""
+        with self._lock:
+            self._submit()
+
+    def close(self):
+        self.flush()
+        with self.metrics.timer('bq_load_wait'):
+            for load_job in self.jobs:
+                try:
+                    load_job.result()  # Waits for table load to complete.
+                finally:
+                    _record_load_job(load_job, self.metrics)
+        print(f"Job finished. {self.total_rows} rows in {len(self.jobs)} load jobs -> {self.table_id}")
+
+
+class AnalyticsRouter:
+    """
+    Fans analytics rows out to every table of bq_schemas.json by its "channel": "all" (campaign_analytics) takes
+    every row, any other channel (e.g. "push") the rows whose channel_family is that channel. Each table has its
+    own AnalyticsStagingWriter, so one fetch -> transform pass loads all of them without extra Braze calls.
+    Rows are built for the campaign_analytics schema and projected to the schema of the other tables.
+    Same interface as AnalyticsStagingWriter (write_rows, close, context manager).
+    """
 
-    campaigns_analytics = []
-    if result.get('data'):
-        messages = result['data'][0]['messages']  # 캠페인의 하루치(길이 = 1) analytics 데이터.
-        campaigns_analytic = {"date": day, "id": id, "original_name": name}
-        utm = name.split('$')
-
-        if len(utm) > 3:
-            campaigns_analytic.update(
-                {"utm_campaign_source": utm[-3], "utm_campaign_medium": utm[-2], "utm_campaign_name": utm[-1]})
+    def __init__(self, client: bigquery.Client, tables, max_rows=STAGING_MAX_ROWS, max_bytes=STAGING_MAX_BYTES):
+        """
+        :param tables: entries of bq_schemas.json (channel, id, schema), see get_analytics_tables
+        """
+        self.routes = []
+        for table in tables:
+            channel = table.get('channel', ANALYTICS_SCHEMA_CHANNEL)
+            project = compile_row_projection(table['schema']) if channel != ANALYTICS_SCHEMA_CHANNEL else None
+            writer = AnalyticsStagingWriter(client, table['id'], table['schema'], max_rows=max_rows,
+                                            max_bytes=max_bytes)
+            self.routes.append((channel, project, writer))
+
+    @property
+    def writers(self):
+        return [writer for _, _, writer in self.routes]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
         else:
-            campaigns_analytic.update({"utm_campaign_source": '', "utm_campaign_medium": '', "utm_campaign_name": ''})
-            print(f"utm naming conversion is wrong: {campaigns_analytic}")
+            self._discard()
 
-        abtest = campaigns_analytic["utm_campaign_name"].split(',')
+    def write_rows(self, rows):
+        families = None
+        for channel, project, writer in self.routes:
+            if channel == ANALYTICS_SCHEMA_CHANNEL:
+                selected = rows
+            else:
+                if families is None:
+                    families = [channel_family(row['channel']) for row in rows]
+                selected = [row for row, family in zip(rows, families) if family == channel]
+            if project is not None:
+                selected = [project(row) for row in selected]
+            if selected:
+                writer.write_rows(selected)
+
+    def _discard(self):
+        for writer in self.writers:
+            writer._discard()
+
+    def close(self):
+        for writer in self.writers:
+            writer.flush()      # 테이블별 마지막 load job 을 먼저 모두 제출하고 함께 기다림
+        for writer in self.writers:
+            writer.close()
+
+
+def get_today_campaign_analytics_from_id_name(campaign_id_name, day, ctx=None):
+    print(f"Getting campaigns analytics... for {day}")
+    id = campaign_id_name[0]
+    name = campaign_id_name[1]
 
-        if len(messages) > 1:  # 통합 채널 = ios/aos & variation 없음
-            try:
-                for ch in messages.keys():
-                    try:
-                        print(f"통합 채널 ch:{ch}, name:{name}\nraw_result:{messages[ch][0]}")
-                    except IndexError:
-                        break
-
-                    if int(messages[ch][0]['sent']) == 0:
-                        print(f"Not sent. No data today")
-                        continue
-
-                    campaigns_analytic[ch] = {
-                        "sent": int(messages[ch][0]['sent']) if messages[ch][0].get('sent') else None,
-                        "direct_opens": int(messages[ch][0]['direct_opens']) if messages[ch][0].get(
-                            'direct_opens') else None,
-                        "total_opens": int(messages[ch][0]['total_opens']) if messages[ch][0].get(
-                            'total_opens') else None,
-                        "bounces": int(messages[ch][0]['bounces']) if messages[ch][0].get('bounces') else None,
-                        "body_clicks": int(messages[ch][0]['body_clicks']) if messages[ch][0].get(
-                            'body_clicks') else None}
-
-                campaigns_analytic.update({"channel": ','.join([ch for ch in messages.keys()]),
-                                           "conversions": int(result['data'][0]['conversions']) if result['data'][
-                                               0].get('conversions') else None,
-                                           "conversions1": int(result['data'][0]['conversions1']) if result['data'][
-                                               0].get('conversions1') else None,
-                                           "conversions2": int(result['data'][0]['conversions2']) if result['data'][
-                                               0].get('conversions2') else None,
-                                           "conversions3": int(result['data'][0]['conversions3']) if result['data'][
-                                               0].get('conversions3') else None,
-                                           "unique_recipients": int(result['data'][0]['unique_recipients']) if
-                                           result['data'][0].get('unique_recipients') else None,
-                                           "revenue": float(result['data'][0]['revenue']) if result['data'][0].get(
-                                               'revenue') else None})
-            except Exception:
-                _handle_error()
-                return None
+    result = braze_get('/campaigns/data_series', {'campaign_id': id, 'length': 1, 'ending_at': day}, ctx)
 
-            if campaigns_analytic.get('ios_push') or campaigns_analytic.get('android_push'):
-                print(f"1 ios/aos campaigns analytic added: {campaigns_analytic}")
-                campaigns_analytics.append(campaigns_analytic)
-            else:
-                return None
-
-
-        else:  # 개별 채널 & variation 있을수 있음
-            ch = next(iter(messages))
-            print(f"개별 채널 ch:{ch}, name:{name}\nraw_result:{messages[ch]}")
-            for index, var in enumerate(messages[ch]):  # variation loop
-                print(f"<{index + 1}> variation: {var}")
-
-                # variation별 필드 update
-                utm_campaign_name = ''
-                if var.get('variation_name'):
-                    if var['variation_name'] == 'Control Group':
-                        print("Control Group. not analytics data")
-                        continue
-                    elif var['variation_name'] in abtest:
-                        utm_campaign_name = var['variation_name']
-                        variation_name = var['variation_name']
-                    else:
-                        utm_campaign_name = campaigns_analytic['utm_campaign_name']
-                        variation_name = var['variation_name']
-                else:
-                    variation_name = ""
-                    print(f"no variation name")
-
-                # channel별 필드 update
-                if ch in ['ios_push', 'android_push']:
-                    var_analytics = campaigns_analytic.copy()
-                    try:
-                        if int(var['sent']) == 0:
-                            print(f"Not sent. No data today")
-                            continue
-                        var_analytics[ch] = {"sent": int(var['sent']) if var.get('sent') else None,
-                                             "direct_opens": int(var['direct_opens']) if var.get(
-                                                 'direct_opens') else None,
-                                             "total_opens": int(var['total_opens']) if var.get('total_opens') else None,
-                                             "bounces": int(var['bounces']) if var.get('bounces') else None,
-                                             "body_clicks": int(var['body_clicks']) if var.get('body_clicks') else None}
-
-                        var_analytics.update({"channel": ch,
-                                              "variation_name": variation_name,
-                                              "utm_campaign_name": utm_campaign_name,
-                                              "conversions": int(var['conversions']) if var.get(
-                                                  'conversions') else None,
-                                              "conversions1": int(var['conversions1']) if var.get(
-                                                  'conversions1') else None,
-                                              "conversions2": int(var['conversions2']) if var.get(
-                                                  'conversions2') else None,
-                                              "conversions3": int(var['conversions3']) if var.get(
-                                                  'conversions3') else None,
-                                              "unique_recipients": int(var['unique_recipients']) if var.get(
-                                                  'unique_recipients') else None,
-                                              "revenue": float(var['revenue']) if var.get('revenue') else None})
-                    except KeyError:
-                        continue
+    campaigns_analytics = analytics_rows_from_data_series(result, day, id, name)
+    if campaigns_analytics is None:
+        return None
 
-                elif ch == 'webhook':
-                    var_analytics = campaigns_analytic.copy()
-                    try:
-                        if int(var['sent']) == 0:
-                            print(f"Not sent. No data today")
-                            continue
-                        var_analytics.update(
-                            {"sent": int(var['sent']) if var.get('sent') else None,  # "errors": int(var['errors'])
-                             "channel": ch,
-                             "variation_name": variation_name,
-                             "utm_campaign_name": utm_campaign_name,
-                             "conversions": int(var['conversions']) if var.get('conversions') else None,
-                             "conversions1": int(var['conversions1']) if var.get('conversions1') else None,
-                             "conversions2": int(var['conversions2']) if var.get('conversions2') else None,
-                             "conversions3": int(var['conversions3']) if var.get('conversions3') else None,
-                             "unique_recipients": int(var['unique_recipients']) if var.get(
-                                 'unique_recipients') else None,
-                             "revenue": float(var['revenue']) if var.get('revenue') else None})
+    logger.debug("%s", campaigns_analytics)
+    return campaigns_analytics
 
-                    except KeyError:
-                        continue
 
-                elif ch == 'email':
-                    var_analytics = campaigns_analytic.copy()
-                    try:
-                        if int(var['sent']) == 0:
-                            print(f"Not sent. No data today")
-                            continue
-                        var_analytics.update({"sent": int(var['sent']) if var.get('sent') else None,
-                                              "opens": int(var['opens']) if var.get('opens') else None,
-                                              "unique_opens": int(var['unique_opens']) if var.get(
-                                                  'unique_opens') else None,
-                                              "clicks": int(var['clicks']) if var.get('clicks') else None,
-                                              "unique_clicks": int(var['unique_clicks']) if var.get(
-                                                  'unique_clicks') else None,
-                                              "delivered": int(var['delivered']) if var.get('delivered') else None,
-                                              "channel": ch,
-                                              "variation_name": variation_name,
-                                              "utm_campaign_name": utm_campaign_name,
-                                              "conversions": int(var['conversions']) if var.get(
-                                                  'conversions') else None,
-                                              "conversions1": int(var['conversions1']) if var.get(
-                                                  'conversions1') else None,
-                                              "conversions2": int(var['conversions2']) if var.get(
-                                                  'conversions2') else None,
-                                              "conversions3": int(var['conversions3']) if var.get(
-                                                  'conversions3') else None,
-                                              "unique_recipients": int(var['unique_recipients']) if var.get(
-                                                  'unique_recipients') else None,
-                                              "revenue": float(var['revenue']) if var.get('revenue') else None})
-                    except KeyError:
-                        continue
+def analytics_rows_from_data_series(result, day, id, name):
+    """
+    :param result: /campaigns/data_series response of one day (length=1)
+    :return: analytics rows, or None (see flatten_analytics_day)
+    """
+    if not result.get('data'):
+        return []
+    return flatten_analytics_day(result['data'][0], day, id, name)  # 캠페인의 하루치(길이 = 1)
 
-                elif ch == 'trigger_in_app_message':
-                    var_analytics = campaigns_analytic.copy()
-                    try:
-                        if int(var['impressions']) == 0:
-                            print(f"Not impressed. No data today")
-                            continue
-                        var_analytics.update(
-                            {"impressions": int(var['impressions']) if var.get('impressions') else None,
-                             "clicks": int(var['clicks']) if var.get('clicks') else None,
-                             "first_button_clicks": int(var['first_button_clicks']) if var.get(
-                                 'first_button_clicks') else None,
-                             "second_button_clicks": int(var['second_button_clicks']) if var.get(
-                                 'second_button_clicks') else None,
-                             "channel": ch,
-                             "variation_name": variation_name,
-                             "utm_campaign_name": utm_campaign_name,
-                             "conversions": int(var['conversions']) if var.get('conversions') else None,
-                             "conversions1": int(var['conversions1']) if var.get('conversions1') else None,
-                             "conversions2": int(var['conversions2']) if var.get('conversions2') else None,
-                             "conversions3": int(var['conversions3']) if var.get('conversions3') else None,
-                             "unique_recipients": int(var['unique_recipients']) if var.get(
-                                 'unique_recipients') else None,
-                             "revenue": float(var['revenue']) if var.get('revenue') else None})
-                    except KeyError:
-                        continue
 
-                print(f"1 {ch} campaigns analytic added: {var_analytics}")
-                campaigns_analytics.append(var_analytics)
+def get_campaign_analytics_range_from_id_name(campaign_id_name, start_day, end_day, ctx=None):
+    """
+    Range form of get_today_campaign_analytics_from_id_name: a single /campaigns/data_series call with length=N
+    instead of N calls with length=1. Every entry is dated by its own 'time' (Braze may return fewer entries than
+    length); entries outside start_day ~ end_day are dropped.
+    :return: analytics rows of every day from start_day to end_day, as one batch
+    """
+    id = campaign_id_name[0]
+    name = campaign_id_name[1]
+    start_day, end_day = start_day[:10], end_day[:10]
+    length = (datetime.fromisoformat(end_day) - datetime.fromisoformat(start_day)).days + 1
+    print(f"Getting campaigns analytics... for {start_day} ~ {end_day} ({length} days)")
+
+    result = braze_get('/campaigns/data_series', {'campaign_id': id, 'length': length, 'ending_at': end_day}, ctx)
 
-    print(campaigns_analytics)
+    campaigns_analytics = []
+    for day_data in result.get('data') or []:
+        day = (day_data.get('time') or '')[:10]
+        if not start_day <= day <= end_day:
+            logger.debug("data_series entry outside %s ~ %s: %s", start_day, end_day, day_data.get('time'))
+            continue
+        day_analytics = flatten_analytics_day(day_data, day, id, name)
+        if day_analytics:
+            campaigns_analytics.extend(day_analytics)
+
+    print(f"{len(campaigns_analytics)} analytics rows for {id}")
     return campaigns_analytics
 
 
-def insert_date_to_joined_all_table(client: bigquery.Client, target_table_id: str, ga_table=TABLE_DATE, campaign=TDB_YESTERDAY):
-    print(f"\nInserting data to the all joined tables: {target_table_id}")
-
-    try:
-        sql = f"""INSERT INTO braze_campaigns.ga_bi_joined_analytics 
-        (date, id, original_name, utm_campaign_source, utm_campaign_medium, utm_campaign_name, channel,
+JOINED_ALL_COLUMNS = """date, id, original_name, utm_campaign_source, utm_campaign_medium, utm_campaign_name, channel,
         ios_push, android_push, sent, opens, unique_opens, unique_clicks, delivered,
         impressions, clicks, first_button_clicks, second_button_clicks, conversions, conversions1, conversions2, conversions3, 
-        unique_recipients, revenue, GA_visit, GA_bounces, GA_transaction, GA_revenue, BI_conversion, BI_revenue)
+        unique_recipients, revenue, GA_visit, GA_bounces, GA_transaction, GA_revenue, BI_conversion, BI_revenue"""
+
+
+GA_SESSIONS_DATASET = 'elandmallbigquery.118452709'
+TABLE_ANALYTICS = 'braze_campaigns.campaign_analytics'
+TABLE_INTERNAL_BI = 'braze_campaigns.eland_internal_bi'
+TABLE_GA_ROLLUP = 'braze_campaigns.ga_sessions_daily_rollup'
+
+GA_SESSIONS_JOIN = {
+    'cte': """ga AS ( SELECT date, trafficSource, totals FROM `{ga_dataset}.ga_sessions_*`
+                     WHERE _TABLE_SUFFIX IN UNNEST(@ga_table_suffixes))""",
+    'aggregates': """COUNT(totals.visits) as GA_visit, COUNT(totals.bounces) as GA_bounces, COUNT(totals.transactions) as GA_transaction, SUM(totals.totalTransactionRevenue) as GA_revenue""",
+    'on': """braze.utm_campaign_source = ga.trafficSource.source 
+            AND braze.utm_campaign_medium = ga.trafficSource.medium
+            AND braze.utm_campaign_name = ga.trafficSource.campaign
+            AND braze.date = PARSE_DATE("%Y%m%d", ga.date)""",
+}
+# rollup 한 줄 = 세션 COUNT. 조인된 row마다 더하면 세션 단위 조인의 COUNT와 같은 값
+GA_ROLLUP_JOIN = {
+    'cte': """ga AS ( SELECT date AS ga_date, source AS ga_source, medium AS ga_medium, campaign AS ga_campaign,
+                            visits AS ga_visits, bounces AS ga_bounces, transactions AS ga_transactions, revenue AS ga_revenue
+                     FROM `{ga_rollup}` WHERE date IN UNNEST(@dates))""",
+    'aggregates': """IFNULL(SUM(ga_visits), 0) as GA_visit, IFNULL(SUM(ga_bounces), 0) as GA_bounces, IFNULL(SUM(ga_transactions), 0) as GA_transaction, SUM(ga_revenue) as GA_revenue""",
+    'on': """braze.utm_campaign_source = ga.ga_source 
+            AND braze.utm_campaign_medium = ga.ga_medium
+            AND braze.utm_campaign_name = ga.ga_campaign
+            AND braze.date = ga.ga_date""",
+}
+
+
+def _date_params(dates):
+    """:return: the @dates (DATE array) and @ga_table_suffixes (YYYYMMDD array) parameters of the GA/BI queries"""
+    return {'dates': [datetime.fromisoformat(day).date() for day in dates],
+            'ga_table_suffixes': [day.replace('-', '') for day in dates]}
+
+
+def _ensure_ga_rollup_table(client: bigquery.Client):
+    sql = f"""CREATE TABLE IF NOT EXISTS `{client.project}.{TABLE_GA_ROLLUP}` (
+                date DATE, source STRING, medium STRING, campaign STRING,
+                visits INT64, bounces INT64, transactions INT64, revenue INT64, built_at TIMESTAMP)
+                PARTITION BY date
+                CLUSTER BY source, medium, campaign"""
+    run_query(client, sql)
+
+
+def refresh_ga_rollup(client: bigquery.Client, dates, ctx=None):
+    """
+    (Re)builds the daily GA totals per trafficSource (source/medium/campaign) of the given days
+    from their ga_sessions_YYYYMMDD shards, in one transaction.
+    """
+    dates = sorted(set(dates))
+    if not dates:
+        return
+    print(f"\nRefreshing GA rollup for {dates}")
+    ga_dataset = (ctx or default_context()).ga_sessions_dataset
+    rollup_table_id = f"{client.project}.{TABLE_GA_ROLLUP}"
+    sql = f"""BEGIN TRANSACTION;
+
+        DELETE FROM `{rollup_table_id}` WHERE date IN UNNEST(@dates);
+
+        INSERT INTO `{rollup_table_id}` (date, source, medium, campaign, visits, bounces, transactions, revenue, built_at)
+        SELECT PARSE_DATE("%Y%m%d", date), trafficSource.source, trafficSource.medium, trafficSource.campaign,
+            COUNT(totals.visits), COUNT(totals.bounces), COUNT(totals.transactions), SUM(totals.totalTransactionRevenue),
+            CURRENT_TIMESTAMP()
+        FROM `{ga_dataset}.ga_sessions_*`
+        WHERE _TABLE_SUFFIX IN UNNEST(@ga_table_suffixes)
+        GROUP BY 1, 2, 3, 4;
 
-        WITH ga AS ( SELECT * FROM `elandmallbigquery.118452709.ga_sessions_{ga_table}`),
-            braze AS ( SELECT * FROM `elandmallbigquery.braze_campaigns.campaign_analytics` WHERE date = '{campaign}'),
-            bi AS ( SELECT * FROM `elandmallbigquery.braze_campaigns.eland_internal_bi`)
+        COMMIT TRANSACTION;"""
+    run_query(client, sql, _date_params(dates))
+
+
+def update_ga_rollup(client: bigquery.Client, dates=None, ctx=None):
+    """
+    Incremental maintenance of the GA rollup: only days whose ga_sessions shard is new, or was modified after
+    the day was rolled up, are rebuilt.
+    :param dates: limit the check to these days (YYYY-MM-DD); every shard when None
+    :return: list of days that were rebuilt
+    """
+    _ensure_ga_rollup_table(client)
+    ga_dataset = (ctx or default_context()).ga_sessions_dataset
+    sql = f"""WITH shards AS (
+                SELECT PARSE_DATE("%Y%m%d", SUBSTR(table_id, 13)) AS date, TIMESTAMP_MILLIS(last_modified_time) AS modified_at
+                FROM `{ga_dataset}.__TABLES__`
+                WHERE REGEXP_CONTAINS(table_id, r'^ga_sessions_\\d{{8}}$')),
+            built AS (
+                SELECT date, MAX(built_at) AS built_at FROM `{client.project}.{TABLE_GA_ROLLUP}` GROUP BY date)
+            SELECT FORMAT_DATE("%Y-%m-%d", shards.date) AS date
+            FROM shards LEFT JOIN built USING (date)
+            WHERE built.built_at IS NULL OR built.built_at < shards.modified_at"""
+    stale_dates = [row[0] for row in run_query(client, sql)]
+    if dates is not None:
+        stale_dates = sorted(set(stale_dates) & set(dates))
+    refresh_ga_rollup(client, stale_dates, ctx)
+    return stale_dates
+
+
+def missing_ga_shards(client: bigquery.Client, dates, ctx=None):
+    """
+    :return: the days (YYYY-MM-DD) of dates whose ga_sessions_YYYYMMDD shard has not landed yet. Joining them would
+             write GA_visit/GA_bounces/GA_transaction = 0 that nothing rebuilds once the shard arrives
+    """
+    dates = sorted(set(dates))
+    if not dates:
+        return []
+    ga_dataset = (ctx or default_context()).ga_sessions_dataset
+    shards = {day: f"ga_sessions_{day.replace('-', '')}" for day in dates}
+    rows = run_query(client, f"SELECT table_id FROM `{ga_dataset}.__TABLES__` WHERE table_id IN UNNEST(@shards)",
+                     {'shards': list(shards.values())})
+    landed = {row[0] for row in rows}
+    return [day for day in dates if shards[day] not in landed]
+
+
+def replace_joined_analytics_for_dates(client: bigquery.Client, target_table_id: str, dates, use_ga_rollup=True,
+                                       update_rollup=True, ctx=None):
+    """
+    Idempotent rebuild of the given days of the GA/BI joined table in a single job.
+    bi and the GA source are filtered to those days before the join, and the days are deleted and re-inserted
+    inside one transaction, so a rerun replaces a day instead of duplicating it.
+    :param use_ga_rollup: join the small daily GA rollup instead of the ga_sessions_* shards with their nested hits
+    :param update_rollup: bring the rollup of these days up to date first (update_ga_rollup). False when the caller
+                          already did, e.g. backfill() once for all its days
+    Raises RuntimeError, before touching the table, when a day has no ga_sessions shard yet (missing_ga_shards).
+    """
+    dates = sorted(set(dates))
+    print(f"\nReplacing {dates} in the all joined table: {target_table_id}")
+    missing = missing_ga_shards(client, dates, ctx)
+    if missing:
+        raise RuntimeError(f"ga_sessions shards of {missing} have not landed yet, not joining {target_table_id}")
+    if use_ga_rollup:
+        if update_rollup:
+            update_ga_rollup(client, dates, ctx)
+        ga_join = GA_ROLLUP_JOIN
+    else:
+        ga_join = GA_SESSIONS_JOIN
+    ga_cte = ga_join['cte'].format(ga_dataset=(ctx or default_context()).ga_sessions_dataset,
+                                   ga_rollup=f"{client.project}.{TABLE_GA_ROLLUP}")
+    sql = f"""BEGIN TRANSACTION;
+
+        DELETE FROM `{client.project}.{target_table_id}` WHERE date IN UNNEST(@dates);
+
+        INSERT INTO `{client.project}.{target_table_id}`
+        ({JOINED_ALL_COLUMNS})
+
+        WITH {ga_cte},
+            braze AS ( SELECT * FROM `{client.project}.{TABLE_ANALYTICS}` WHERE date IN UNNEST(@dates)),
+            bi AS ( SELECT * FROM `{client.project}.{TABLE_INTERNAL_BI}` WHERE date IN UNNEST(@dates))
 
         SELECT braze.date, id, original_name, utm_campaign_source, utm_campaign_medium, utm_campaign_name, ANY_VALUE(braze.channel) AS channel,
             ANY_VALUE(ios_push) AS ios_push, ANY_VALUE(android_push) AS android_push,
@@ -619,53 +1830,71 @@ def insert_date_to_joined_all_table(client: bigquery.Client, target_table_id: st
             ANY_VALUE(impressions) AS impressions, ANY_VALUE(clicks) AS clicks, ANY_VALUE(first_button_clicks) AS first_button_clicks, ANY_VALUE(second_button_clicks) AS second_button_clicks, 
             ANY_VALUE(conversions) AS conversions, ANY_VALUE(conversions1) AS conversions1, ANY_VALUE(conversions2) AS conversions2, ANY_VALUE(conversions3) AS conversions3, 
             ANY_VALUE(unique_recipients) AS unique_recipients, ANY_VALUE(revenue) AS revenue,
-            COUNT(totals.visits) as GA_visit, COUNT(totals.bounces) as GA_bounces, COUNT(totals.transactions) as GA_transaction, SUM(totals.totalTransactionRevenue) as GA_revenue,
+            {ga_join['aggregates']},
             ANY_VALUE(bi.conversion) as BI_conversion, ANY_VALUE(bi.conversion_revenue) as BI_revenue
         FROM braze 
         LEFT JOIN ga
-            ON braze.utm_campaign_source = ga.trafficSource.source 
-            AND braze.utm_campaign_medium = ga.trafficSource.medium
-            AND braze.utm_campaign_name = ga.trafficSource.campaign
-            AND braze.date = PARSE_DATE("%Y%m%d", ga.date)
+            ON {ga_join['on']}
         LEFT JOIN bi
             ON braze.utm_campaign_source = bi.chnl_no
             AND braze.utm_campaign_name = bi.chnl_detail_no_num
             AND braze.date = bi.date
-        GROUP BY braze.date, id, original_name, utm_campaign_source, utm_campaign_medium, utm_campaign_name
-        ORDER BY date ASC"""
-        query_job = client.query(sql)
-        result = query_job.result()
+        GROUP BY braze.date, id, original_name, utm_campaign_source, utm_campaign_medium, utm_campaign_name;
+
+        COMMIT TRANSACTION;"""
+    run_query(client, sql, _date_params(dates))
+    print("Job finished.")
+
+
+def insert_date_to_joined_all_table(client: bigquery.Client, target_table_id: str, campaign=None, ctx=None):
+    """:param campaign: YYYY-MM-DD to insert, default ctx.tdb_yesterday"""
+    ctx = ctx or default_context()
+    campaign = campaign or ctx.tdb_yesterday
+    print(f"\nInserting data to the all joined tables: {target_table_id}")
+    try:
+        replace_joined_analytics_for_dates(client, target_table_id, [campaign], ctx=ctx)
     except Exception:
         _handle_error()
         return
-    print("Job finished.")
 
 
-if __name__ == '__main__':
-    """누락된 날짜를 입"""
-    requested_date = '2022-06-01'
+TABLE_CAMPAIGNS_LIST = 'braze_campaigns.campaigns_list'
+TABLE_JOINED_ALL = 'braze_campaigns.ga_bi_joined_analytics'
+BACKFILL_MAX_WORKERS = 4    # 동시에 처리하는 날짜 수. 날짜마다 BigQuery job은 하나씩 순서대로 돌기 때문에 job 동시 실행 수 상한도 됨
+BACKFILL_CHECKPOINT_PATH = 'backfill_checkpoint.json'
 
-    date = datetime.fromisoformat(requested_date)
-    # tbd_date = datetime.strftime(date - timedelta(days=2), '%Y-%m-%d')
-    # ytb_date = datetime.strftime(date - timedelta(days=1), '%Y-%m-%d')
-    hyphens_rm_date = requested_date.replace('-', '')
-    print(f"start date: {requested_date}, now:", datetime.now().isoformat(),", utcnow:", datetime.utcnow().isoformat()) # 현재 시간 확인
 
-    table_campaigns_list = 'braze_campaigns.campaigns_list'
+def sync_missing_campaign_list(client: bigquery.Client, requested_date, state_index: CampaignStateIndex = None,
+                               ctx=None):
     """(1) list에 캠페인이 누락 됐을 경우, 해당 일자부터 오늘까지 수정된 캠페인 조회하는 campaign_list API 다시 호출해서 빅쿼리에 없는 데이터 적재"""
     """
     SELECT *
     FROM `elandmallbigquery.braze_campaigns.campaigns_list`
     WHERE name like '%2206%'
     """
-    updated_campaigns = get_updated_campaign_list(date)
-    existed_ids = select_all_ids_from_bq(table_campaigns_list)
-    for campaign in updated_campaigns:
-        if campaign['id'] not in existed_ids:
-            # 기존 list 테이블에 없는 캠페인들은 campaign_list 테이블에 삽입
-            insert_data_to_bq(BQ, campaign, table_campaigns_list)
+    updated_campaigns = get_updated_campaign_list(requested_date, ctx=ctx)
+    if state_index is not None:
+        state_index.update_from_list(updated_campaigns)     # 수정된 캠페인은 다음 디테일 조회 대상
+    # 기존 list 테이블에 없는 캠페인들은 campaign_list 테이블에 한 번에 삽입. 후보 id만 빅쿼리로 보내서 확인
+    missing_ids = select_missing_ids_from_bq(client, TABLE_CAMPAIGNS_LIST, [campaign['id'] for campaign in updated_campaigns])
+    sync_campaign_list_to_bq(client, [campaign for campaign in updated_campaigns if campaign['id'] in missing_ids],
+                             TABLE_CAMPAIGNS_LIST)
 
 
+def skip_missing_campaign(error, c_id, day, ctx=None):
+    """
+    :return: True when error is a BrazeAPIError for a campaign Braze no longer knows (400/404), after logging and
+             counting it; retry-exhausted 429/5xx and connection errors return False and should fail the day
+    """
+    if not isinstance(error, BrazeAPIError) or error.status_code not in BRAZE_MISSING_CAMPAIGN_STATUSES:
+        return False
+    logger.warning("Braze has no data_series for campaign %s on %s (HTTP %d), skipped", c_id, day,
+                   error.status_code)
+    (ctx or default_context()).metrics.incr('braze_missing_campaigns')
+    return True
+
+
+def load_oneoff_campaign_analytics(requested_date, campaigns, writer: AnalyticsRouter, ctx=None):
     """(2) analytics에 일회성 캠페인이 누락 됐을 경우, list에 있는 해당 날짜의 일회성 캠페인을 campaign analytics API 다시 호출해서 삽입"""
     """
     SELECT date, id, original_name, count(original_name), sent, android_push.sent, ios_push.sent, FROM `elandmallbigquery.braze_campaigns.campaign_analytics`
@@ -673,38 +1902,499 @@ if __name__ == '__main__':
     group by 1,2,3,5,6,7
     order by date, original_name, id
     """
-    table_id = bq_schema[0]['id']
-    table_schema = bq_schema[0]['schema']
-    _check_if_table_exists(table_id, table_schema)  # check if table exists, otherwise create
+    # campaigns: select_oneoff_campaigns_from_bq 결과. 해당 날짜의 일회성 캠페인만 들어있음
+    for c_id, c_name in zip(campaigns['id'], campaigns['name']):
+        print(f"Calling BRAZE API for the one-off campaign... id: {c_id}, name: {c_name}")
+        try:
+            today_analytics = get_today_campaign_analytics_from_id_name([c_id, c_name], requested_date, ctx)
+        except BrazeAPIError as e:
+            if skip_missing_campaign(e, c_id, requested_date, ctx):
+                continue
+            raise
+        if today_analytics is not None:
+            if len(today_analytics) != 0:
+                # print(today_analytics)
+                writer.write_rows(today_analytics)   # 캠페인마다 load job 대신 하루치를 파일 하나로 적재
+
+
+SWAP_RELOADED_ANALYTICS_SQL = """DELETE FROM `{table}`
+                WHERE DATE(date) IN UNNEST(@dates)
+                AND CONCAT(CAST(DATE(date) AS STRING), '|', {key}) IN UNNEST(@{day_keys});
+                INSERT INTO `{table}` ({columns})
+                SELECT {columns} FROM `{staging}` WHERE DATE(date) IN UNNEST(@dates);"""
+
+
+def create_analytics_staging_tables(client: bigquery.Client, tables):
+    """
+    Empty staging tables, with the schema of every analytics table and expiring after STAGING_TABLE_EXPIRATION,
+    for a backfill to load into before swap_in_reloaded_analytics puts the rows in place.
+    :param tables: analytics tables (get_analytics_tables)
+    :return: the same entries with the ids of the staging tables, in the same order
+    """
+    staging_tables = []
+    for table in tables:
+        project, dataset, name = table['id'].split('.')
+        staging_table = bigquery.Table(f"{project}.{dataset}._staging_{name}_{uuid.uuid4().hex}",
+                                       schema=create_schema_from_json(table['schema']))
+        staging_table.expires = datetime.utcnow() + STAGING_TABLE_EXPIRATION
+        client.create_table(staging_table)
+        staging_tables.append(dict(table, id=f"{project}.{dataset}.{staging_table.table_id}"))
+    return staging_tables
+
+
+def drop_staging_tables(client: bigquery.Client, staging_tables):
+    for table in staging_tables:
+        client.delete_table(table['id'], not_found_ok=True)
 
-    campaign_ids_names = select_all_ids_names_from_bq(BQ, table_campaigns_list)
-    for campaign in campaign_ids_names:
-        c_id = campaign[0][1]
-        c_name = campaign[1][1]
 
-        oneoff_c_p = re.compile('^(\d{6}_.+)')  # 일회성 캠페인만 확인
-        if oneoff_c_p.match(c_name):
-            if c_name.startswith(hyphens_rm_date[2:8]):  # 해당 날짜의 일회성 캠페인만..
-                print(f"Calling BRAZE API for the one-off campaign... id: {c_id}, name: {c_name}")
-                today_analytics = get_today_campaign_analytics_from_id_name([c_id, c_name], requested_date)
-                if today_analytics is not None:
-                    if len(today_analytics) != 0:
-                        # print(today_analytics)
-                        load_table_from_analytics_result(BQ, today_analytics, table_id, table_schema)
+def swap_in_reloaded_analytics(client: bigquery.Client, tables, staging_tables, campaigns_by_day):
+    """
+    Replaces the rows of the reloaded campaigns (the given campaigns on the given days) of every analytics table
+    with the rows loaded into its staging table, in one transaction. A day that failed to load is left out, so its
+    existing rows stay untouched, and loading a day again (a resumed backfill) never appends it twice.
+    Tables without an id column (campaign_analytics_push) are matched on original_name.
+    :param campaigns_by_day: {YYYY-MM-DD: columnar batch ({'id': [...], 'name': [...]}) of the reloaded campaigns}
+    """
+    dates = sorted(campaigns_by_day)
+    if not dates:
+        return
+    params = {'dates': [datetime.fromisoformat(day).date() for day in dates]}
+    statements = []
+    for index, (table, staging) in enumerate(zip(tables, staging_tables)):
+        key = 'id' if any(column['name'] == 'id' for column in table['schema']) else 'original_name'
+        params[f'day_keys_{index}'] = [f"{day}|{value}" for day in dates
+                                       for value in campaigns_by_day[day]['id' if key == 'id' else 'name']]
+        statements.append(SWAP_RELOADED_ANALYTICS_SQL.format(
+            table=table['id'], staging=staging['id'], key=key, day_keys=f'day_keys_{index}',
+            columns=', '.join(column['name'] for column in table['schema'])))
+    sql = "BEGIN TRANSACTION;\n" + "\n".join(statements) + "\nCOMMIT TRANSACTION;"
+    run_query(client, sql, params, {name: 'STRING' for name in params if name != 'dates'})
+    print(f"swapped in the reloaded analytics of {dates}")
+
+
+def run_daily_steps(client: bigquery.Client, requested_date, campaigns, tables, ctx=None):
+    """
+    Step (2) of the missing-date script for one day: loads the analytics of its one-off campaigns.
+    Step (1) is shared by every day of a backfill, step (3) (the join) runs once the day is loaded.
+    :param tables: tables to load, the analytics tables (get_analytics_tables) or their staging tables
+    """
+    print(f"start date: {requested_date}")
+    with AnalyticsRouter(client, tables) as writer:
+        load_oneoff_campaign_analytics(requested_date, campaigns, writer, ctx)
+
 
-    table_joined_all = 'braze_campaigns.ga_bi_joined_analytics'
-    """(3) analytics에 일회성 캠페인이 누락 됐을 경우, list에 있는 해당 날짜의 일회성 캠페인을 campaign analytics API 다시 호출해서 삽입"""
+def join_loaded_days(client: bigquery.Client, dates, ctx=None):
+    """(3) ga_bi_joined_analytics 테이블에 해당 날짜 삽입"""
     """
     SELECT date, id, original_name, count(original_name), sent, android_push.sent, ios_push.sent, GA_visit, BI_conversion FROM `elandmallbigquery.braze_campaigns.ga_bi_joined_analytics`
     where date > '2022-06-05'
     group by 1,2,3,5,6,7,8,9
     order by date, original_name, id
     """
-    insert_date_to_joined_all_table(BQ, table_joined_all, hyphens_rm_date, requested_date)
-    print("DONE for the table: ga_bi_joined_analytics")
+    # 재실행해도 중복 없이 해당 날짜만 교체. GA rollup은 backfill()이 시작할 때 한 번 갱신
+    replace_joined_analytics_for_dates(client, TABLE_JOINED_ALL, dates, update_rollup=False, ctx=ctx)
+    print(f"DONE for the table: ga_bi_joined_analytics ({', '.join(sorted(dates))})")
+
+
+class BackfillCheckpoint:
+    """
+    JSON file of the days a backfill has loaded (step 2) and finished (step 3, the join), rewritten atomically after
+    every step, so that a crashed run resumes where it stopped instead of starting over: a loaded day is only joined
+    again, its analytics are not appended a second time.
+    The file records the range (start_date ~ end_date) of its run; a file of another range is ignored.
+    """
 
-    """2개이상 중복되어 삽입되었을 경우는 해당 날짜 삭제하고 다시 진행"""
+    def __init__(self, path=BACKFILL_CHECKPOINT_PATH, start_date=None, end_date=None):
+        self.path = path
+        self.range = [start_date, end_date or start_date]
+        self._lock = threading.Lock()
+        self.completed = set()
+        self.loaded = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('range') == self.range:
+                self.completed = set(state.get('completed', []))
+                self.loaded = set(state.get('loaded', [])) | self.completed
+            else:   # 다른 범위로 돌다 멈춘 실행의 체크포인트: 이번 실행의 날짜는 처음부터
+                print(f"ignoring checkpoint {path} of another range: {state.get('range')}")
+
+    def _write(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'range': self.range, 'completed': sorted(self.completed), 'loaded': sorted(self.loaded)}, f)
+        os.replace(tmp_path, self.path)
+
+    def mark_loaded(self, day):
+        with self._lock:
+            self.loaded.add(day)
+            self._write()
+
+    def mark_done(self, day):
+        with self._lock:
+            self.loaded.add(day)
+            self.completed.add(day)
+            self._write()
+
+    def clear(self):
+        with self._lock:
+            self.completed = set()
+            self.loaded = set()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+_PIPELINE_END = object()
+
+
+async def _pipeline_fetch(jobs: asyncio.Queue, fetched: asyncio.Queue, executor, ctx=None):
+    """Fetch stage: one /campaigns/data_series call per (day, campaign), in a thread of executor."""
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await jobs.get()
+        if job is _PIPELINE_END:
+            await fetched.put(_PIPELINE_END)
+            return
+        day, c_id, c_name = job
+        print(f"Calling BRAZE API for the one-off campaign... id: {c_id}, name: {c_name}, date: {day}")
+        try:
+            result = await loop.run_in_executor(executor, braze_get, '/campaigns/data_series',
+                                                {'campaign_id': c_id, 'length': 1, 'ending_at': day}, ctx)
+        except Exception as e:
+            if skip_missing_campaign(e, c_id, day, ctx):
+                result = {}     # 해당 캠페인은 데이터 없음으로 처리
+            else:
+                _handle_error()
+                result = e
+        await fetched.put((day, c_id, c_name, result))
+
+
+async def _pipeline_transform(fetched: asyncio.Queue, transformed: asyncio.Queue, fetchers):
+    """Transform stage: flattens each response into analytics rows. Failures are passed on as the exception."""
+    while fetchers:
+        item = await fetched.get()
+        if item is _PIPELINE_END:
+            fetchers -= 1
+            continue
+        day, c_id, c_name, result = item
+        if not isinstance(result, Exception):
+            try:
+                result = analytics_rows_from_data_series(result, day, c_id, c_name)
+            except Exception as e:
+                _handle_error()
+                result = e
+        await transformed.put((day, result))
+    await transformed.put(_PIPELINE_END)
+
+
+async def run_analytics_pipeline(client: bigquery.Client, campaigns_by_day, tables, fetch_concurrency=None,
+                                 max_workers=BACKFILL_MAX_WORKERS, queue_size=PIPELINE_QUEUE_SIZE, ctx=None):
     """
-    DELETE FROM `elandmallbigquery.braze_campaigns.ga_bi_joined_analytics`
-    WHERE date = '2022-03-12'
-    """
\ No newline at end of file
+    Step (2) of the missing-date script as an asyncio pipeline: fetch -> transform -> load, connected by bounded
+    queues. Braze calls of the next campaigns run while earlier days are written and loaded, so the run takes about
+    as long as its slowest stage instead of the sum of all of them.
+    Every day gets its own AnalyticsRouter; once its last campaign is transformed the day is loaded in a worker
+    thread, at most max_workers days at a time. Swapping the loaded rows in and the join (step 3) are left to the
+    caller, once for every loaded day, as concurrent transactions on the same table would cancel each other.
+    A day with a failed campaign is not loaded, like a failed day of backfill().
+    :param campaigns_by_day: {YYYY-MM-DD: columnar batch of its one-off campaigns}
+    :param tables: tables to load, the analytics tables (get_analytics_tables) or their staging tables
+    :param fetch_concurrency: Braze calls in flight, default ctx.max_workers
+    :return: list of failed days
+    """
+    ctx = ctx or default_context()
+    fetch_concurrency = fetch_concurrency or ctx.max_workers
+    loop = asyncio.get_running_loop()
+    # fetch + 날짜별 마무리가 서로 기다리지 않도록 전용 executor. loop 의 기본 executor 는 건드리지 않음
+    executor = ThreadPoolExecutor(max_workers=fetch_concurrency + max_workers + 1)
+
+    jobs = asyncio.Queue(maxsize=queue_size)
+    fetched = asyncio.Queue(maxsize=queue_size)
+    transformed = asyncio.Queue(maxsize=queue_size)
+    remaining = {day: len(campaigns['id']) for day, campaigns in campaigns_by_day.items()}
+    writers = {}
+    failed_days = []
+    finishing = []
+    finish_slots = asyncio.Semaphore(max_workers)
+
+    def finish_day(day, writer, failed):
+        print(f"start date: {day}")
+        if failed:
+            writer._discard()
+            print(f"failed day (rerun to resume): {day}")
+            return
+        writer.close()
+
+    async def finish(day):
+        writer = writers.pop(day)
+        failed = day in failed_days
+        async with finish_slots:
+            try:
+                await loop.run_in_executor(executor, finish_day, day, writer, failed)
+            except Exception:
+                _handle_error()
+                failed_days.append(day)
+
+    async def produce():
+        for day, campaigns in campaigns_by_day.items():
+            for c_id, c_name in zip(campaigns['id'], campaigns['name']):
+                await jobs.put((day, c_id, c_name))
+        for _ in range(fetch_concurrency):
+            await jobs.put(_PIPELINE_END)
+
+    async def load():
+        while True:
+            item = await transformed.get()
+            if item is _PIPELINE_END:
+                return
+            day, rows = item
+            if isinstance(rows, Exception):
+                if day not in failed_days:
+                    failed_days.append(day)
+            elif rows:
+                await loop.run_in_executor(executor, writers[day].write_rows, rows)
+            remaining[day] -= 1
+            if remaining[day] == 0:
+                finishing.append(asyncio.create_task(finish(day)))
+
+    for day in campaigns_by_day:
+        writers[day] = AnalyticsRouter(client, tables)
+        if remaining[day] == 0:
+            finishing.append(asyncio.create_task(finish(day)))
+    try:
+        await asyncio.gather(produce(), load(), _pipeline_transform(fetched, transformed, fetch_concurrency),
+                             *(_pipeline_fetch(jobs, fetched, executor, ctx) for _ in range(fetch_concurrency)))
+        await asyncio.gather(*finishing)
+    finally:
+        for writer in writers.values():
+            writer._discard()
+        executor.shutdown(wait=False)
+    return sorted(failed_days)
+
+
+def get_analytics_tables(ctx=None):
+    """
+    :return: the analytics tables of bq_schemas.json (entries with a "channel"), ids in the project of ctx
+    """
+    ctx = ctx or default_context()
+    return [dict(table, id=ctx.qualify(table['id'])) for table in get_bq_schema() if table.get('channel')]
+
+
+def date_range(start_date, end_date=None):
+    """:return: every YYYY-MM-DD from start_date to end_date (inclusive)"""
+    start = datetime.fromisoformat(start_date)
+    return [datetime.strftime(start + timedelta(days=offset), '%Y-%m-%d')
+            for offset in range((datetime.fromisoformat(end_date or start_date) - start).days + 1)]
+
+
+def backfill(start_date, end_date=None, max_workers=None, checkpoint_path=None, pipeline=False,
+             state_index: CampaignStateIndex = None, ctx=None):
+    """
+    Runs the missing-date steps for every day from start_date to end_date (inclusive), several days at a time
+    (max_workers, default ctx.max_days), in the workspace/project of ctx (default_context() when None).
+    Days are loaded (step 2) several at a time into staging tables, then the rows of every loaded day are swapped
+    into the analytics tables in one transaction and joined (step 3) in another, so a day that fails keeps its
+    existing rows. A day whose ga_sessions shard has not landed yet is loaded but not joined, and left failed.
+    The checkpoint of checkpoint_path resumes a crashed run of the same range.
+    With pipeline=True step (2) runs through run_analytics_pipeline instead of one thread per day.
+    With a state_index, one-off campaigns known not to have sent on a day are not called for that day.
+    :return: list of days that failed and are left for the next run
+    """
+    ctx = ctx or default_context()
+    max_workers = max_workers or ctx.max_days
+    checkpoint_path = checkpoint_path or ctx.checkpoint_path
+    end_date = end_date or start_date
+    days = date_range(start_date, end_date)
+    checkpoint = BackfillCheckpoint(checkpoint_path, start_date, end_date)
+    pending_days = [day for day in days if day not in checkpoint.completed]
+    print(f"[{ctx.workspace}] backfill {start_date} ~ {end_date}: {len(pending_days)} of {len(days)} days left, now:",
+          datetime.now().isoformat(), ", utcnow:", datetime.utcnow().isoformat())  # 현재 시간 확인
+    if not pending_days:
+        checkpoint.clear()
+        return []
+
+    client = ctx.get_bq_client()
+    if state_index is not None and len(state_index) == 0:
+        state_index.seed_from_bq(client)
+    sync_missing_campaign_list(client, pending_days[0], state_index, ctx)  # 가장 이른 날짜부터 오늘까지 수정된 캠페인이면 모든 날짜를 커버
+
+    tables = get_analytics_tables(ctx)     # campaign_analytics + 채널별 테이블. 한 번의 호출로 모두 적재
+    for table in tables:
+        # check if table exists, otherwise create
+        _check_if_table_exists(table['id'], table['schema'], table.get('time_partitioning'),
+                               table.get('clustering_fields'), client)
+    oneoff_campaigns = select_oneoff_campaigns_from_bq(client, TABLE_CAMPAIGNS_LIST, pending_days)
+    campaigns_by_prefix = {}
+    for c_id, c_name in zip(oneoff_campaigns['id'], oneoff_campaigns['name']):
+        day_campaigns = campaigns_by_prefix.setdefault(parse_campaign_name(c_name).oneoff_date_prefix,
+                                                       {'id': [], 'name': []})
+        day_campaigns['id'].append(c_id)
+        day_campaigns['name'].append(c_name)
+
+    if state_index is not None:
+        for prefix, day_campaigns in campaigns_by_prefix.items():
+            day = datetime.strptime(prefix, '%y%m%d').strftime('%Y-%m-%d')
+            keep = [state_index.may_have_data(c_id, day) for c_id in day_campaigns['id']]
+            day_campaigns['id'] = [c_id for c_id, k in zip(day_campaigns['id'], keep) if k]
+            day_campaigns['name'] = [c_name for c_name, k in zip(day_campaigns['name'], keep) if k]
+        print("campaign state index:", state_index.stats)
+
+    update_ga_rollup(client, pending_days, ctx)     # 모든 날짜의 GA rollup을 한 번에 (날짜마다 트랜잭션 돌리지 않음)
+
+    # 이미 적재된 날짜(checkpoint.loaded)는 다시 적재하지 않음
+    load_days = [day for day in pending_days if day not in checkpoint.loaded]
+    campaigns_by_day = {day: campaigns_by_prefix.get(oneoff_date_prefix(day), {'id': [], 'name': []})
+                        for day in load_days}
+    staging_tables = create_analytics_staging_tables(client, tables) if load_days else []
+
+    def run_day(day):
+        run_daily_steps(client, day, campaigns_by_day[day], staging_tables, ctx)
+
+    try:
+        if pipeline:
+            failed_days = asyncio.run(run_analytics_pipeline(client, campaigns_by_day, staging_tables,
+                                                             max_workers=max_workers, ctx=ctx))
+        else:
+            failed_days = []
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(run_day, day): day for day in load_days}
+                for future, day in futures.items():
+                    try:
+                        future.result()
+                    except Exception:
+                        _handle_error()
+                        failed_days.append(day)
+
+        # 적재에 성공한 날짜만 기존 row 와 한 트랜잭션으로 교체. 실패한 날짜의 기존 row 는 그대로 남음
+        staged_days = [day for day in load_days if day not in failed_days]
+        if staged_days:
+            try:
+                swap_in_reloaded_analytics(client, tables, staging_tables,
+                                           {day: campaigns_by_day[day] for day in staged_days})
+                for day in staged_days:
+                    checkpoint.mark_loaded(day)
+            except Exception:
+                _handle_error()
+                failed_days = sorted(set(failed_days) | set(staged_days))
+    finally:
+        drop_staging_tables(client, staging_tables)
+
+    # (3) 적재된 날짜 전부를 트랜잭션 하나로 조인. 날짜마다 동시에 돌리면 같은 테이블의 트랜잭션끼리 충돌해서 취소됨
+    joined_days = [day for day in pending_days if day in checkpoint.loaded]
+    missing = missing_ga_shards(client, joined_days, ctx)
+    if missing:     # GA 가 아직 안 들어온 날짜는 조인하지 않고 실패로 남김 (적재는 끝났으니 다음 실행은 조인만)
+        print(f"ga_sessions shards of {missing} have not landed yet, not joined")
+        failed_days = sorted(set(failed_days) | set(missing))
+        joined_days = [day for day in joined_days if day not in missing]
+    if joined_days:
+        try:
+            join_loaded_days(client, joined_days, ctx)
+            for day in joined_days:
+                checkpoint.mark_done(day)
+        except Exception:
+            _handle_error()
+            failed_days = sorted(set(failed_days) | set(joined_days))
+
+    if failed_days:
+        print(f"failed days (rerun to resume): {failed_days}")
+    else:
+        checkpoint.clear()
+    return failed_days
+
+
+def load_run_contexts(path, run_date=None):
+    """
+    Reads the workspaces of a scheduler config file:
+        [{"workspace": "eland", "braze_url": "https://rest.iad-06.braze.com", "braze_token_env": "ELAND_BRAZE_TOKEN",
+          "gcp_project": "elandmallbigquery", "credentials_path": "elandmallbigquery-privatekey.json",
+          "ga_sessions_dataset": "elandmallbigquery.118452709", "max_workers": 8, "max_days": 4,
+          "rate_limit_reserve": 10, "cache_path": ".braze_cache_eland.sqlite"}, ...]
+    The token is read from the environment variable named by braze_token_env (or given as braze_token).
+    :return: list of RunContext
+    """
+    with open(path) as f:
+        workspaces = json.load(f)
+    contexts = []
+    for workspace in workspaces:
+        options = dict(workspace)
+        token_env = options.pop('braze_token_env', None)
+        if token_env:
+            options['braze_token'] = os.environ.get(token_env, '')
+        contexts.append(RunContext(run_date=run_date, **options))
+    return contexts
+
+
+class WorkspaceScheduler:
+    """
+    Runs the backfill of several workspaces in one process, so the per-client cron jobs can share one worker.
+    Every RunContext keeps its own Braze session, rate limiter and circuit breaker (its rate limit budget),
+    BigQuery client and checkpoint; its max_workers bounds its concurrent Braze calls and its max_days the days it
+    processes at once. max_parallel bounds the workspaces running at the same time.
+    """
+
+    def __init__(self, contexts, max_parallel=None):
+        self.contexts = list(contexts)
+        self.max_parallel = max_parallel or len(self.contexts) or 1
+
+    def run(self, start_date, end_date=None, pipeline=False):
+        """
+        :return: {workspace: failed days}; a workspace that failed before its days ran has every day as failed
+        """
+        def run_workspace(ctx):
+            return backfill(start_date, end_date, pipeline=pipeline, ctx=ctx)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            futures = {executor.submit(run_workspace, ctx): ctx for ctx in self.contexts}
+            for future, ctx in futures.items():
+                try:
+                    results[ctx.workspace] = future.result()
+                except Exception:
+                    _handle_error()
+                    results[ctx.workspace] = date_range(start_date, end_date)
+        print("workspaces:", results)
+        return results
+
+
+if __name__ == '__main__':
+    """누락된 날짜를 입력"""
+    parser = argparse.ArgumentParser(description='Reload Braze campaign analytics for missing dates.')
+    parser.add_argument('--start', default='2022-06-01', help='first date to reload (YYYY-MM-DD)')
+    parser.add_argument('--end', help='last date to reload (YYYY-MM-DD), defaults to --start')
+    parser.add_argument('--workers', type=int, default=BACKFILL_MAX_WORKERS, help='days processed at the same time')
+    parser.add_argument('--checkpoint', default=BACKFILL_CHECKPOINT_PATH, help='checkpoint file used to resume')
+    parser.add_argument('--workspaces', help='JSON file of workspaces to run in parallel (see load_run_contexts)')
+    parser.add_argument('--max-parallel', type=int, help='workspaces running at the same time (--workspaces)')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='overlap Braze fetches with BigQuery loads (asyncio pipeline)')
+    parser.add_argument('--state-index', nargs='?', const=CAMPAIGN_STATE_PATH,
+                        help='skip campaigns whose local state (SQLite) shows they cannot have changed')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='DEBUG also logs every Braze payload and analytics row')
+    parser.add_argument('--metrics-out', help='write the run metrics to this file (Prometheus text for *.prom, else JSON), '
+                                              'one file per workspace (<name>_<workspace>.<ext>) with --workspaces')
+    parser.add_argument('--migrate-partitions', action='store_true',
+                        help='rewrite the tables in bq_schemas.json into their partitioned layout and exit')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    if args.migrate_partitions:
+        for table in get_bq_schema():
+            migrate_table_to_partitioned(get_bq_client(), table)
+    elif args.workspaces:
+        contexts = load_run_contexts(args.workspaces)
+        WorkspaceScheduler(contexts, args.max_parallel).run(args.start, args.end, pipeline=args.pipeline)
+        for ctx in contexts:    # workspace 마다 따로 집계. --metrics-out 은 파일 이름 뒤에 _<workspace>
+            if args.metrics_out:
+                root, ext = os.path.splitext(args.metrics_out)
+                ctx.metrics.write(f"{root}_{ctx.workspace}{ext}")
+            print(f"[{ctx.workspace}] metrics:", json.dumps(ctx.metrics.summary()['counters'], sort_keys=True))
+    else:
+        cache = enable_braze_cache()    # 재실행 시 지난 날짜의 analytics는 다시 호출하지 않음
+        state_index = CampaignStateIndex(args.state_index) if args.state_index else None
+        backfill(args.start, args.end, max_workers=args.workers, checkpoint_path=args.checkpoint,
+                 pipeline=args.pipeline, state_index=state_index)
+        print("braze cache:", cache.stats)
+    if args.metrics_out and not args.workspaces:
+        metrics.write(args.metrics_out)
+    print("metrics:", json.dumps(metrics.summary()['counters'], sort_keys=True))
@@ -0,0 +1,70 @@
+"""
+Parsing of Braze campaign names and timestamps.
+
+Campaign names follow `[YYMMDD_]title$utm_source$utm_medium$utm_campaign[,abtest variation names]`; the leading
+YYMMDD_ marks a one-off campaign sent on that date. A campaign name is parsed once per process (lru_cache) and
+reused by every day/variation that refers to it.
+"""
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+from collections import namedtuple
+
+
+UTM_SEPARATOR = '$'
+ABTEST_SEPARATOR = ','
+ONEOFF_NAME_PATTERN = re.compile(r'[0-9]{6}_')    # 일회성 캠페인: 이름이 발송일(YYMMDD_)로 시작
+_TIMESTAMP_PATTERN = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}')
+
+# Braze 는 UTC, 집계 날짜는 KST. KST 하루 = 전날 15:00 ~ 당일 15:00 (UTC)
+KST_DAY_START_UTC_HOUR = 15
+
+CampaignName = namedtuple('CampaignName', ['utm_campaign_source', 'utm_campaign_medium', 'utm_campaign_name',
+                                           'abtest', 'oneoff_date_prefix', 'valid'])
+
+
+@lru_cache(maxsize=65536)
+def parse_campaign_name(name):
+    """
+    :return: CampaignName. utm fields are '' (valid=False) when the name has fewer than 3 '$' separators,
+             abtest is the tuple of variation names listed in utm_campaign_name,
+             oneoff_date_prefix is the YYMMDD of a one-off campaign name, else None
+    """
+    utm = name.split(UTM_SEPARATOR)
+    oneoff_date_prefix = name[:6] if ONEOFF_NAME_PATTERN.match(name) else None
+    if len(utm) > 3:
+        return CampaignName(utm[-3], utm[-2], utm[-1], tuple(utm[-1].split(ABTEST_SEPARATOR)), oneoff_date_prefix,
+                            True)
+    return CampaignName('', '', '', ('',), oneoff_date_prefix, False)
+
+
+def oneoff_date_prefix(day):
+    """
+    :param day: YYYY-MM-DD
+    :return: YYMMDD prefix of the one-off campaigns sent on that day
+    """
+    return day.replace('-', '')[2:8]
+
+
+def parse_braze_timestamp(value):
+    """
+    Parses last_sent/last_edited/created_at of the Braze API ('2022-06-01T01:02:03+00:00' or '2022-06-01T01:02:03Z').
+    The offset is dropped (Braze always returns UTC).
+    :return: naive datetime, or None for any other format
+    """
+    if not value:
+        return None
+    length = len(value)
+    if length == 25 or (length == 20 and value[19] == 'Z'):
+        if _TIMESTAMP_PATTERN.fullmatch(value, 0, 19):
+            return datetime.fromisoformat(value[:19])
+    return None
+
+
+def kst_day_window(day):
+    """
+    :param day: YYYY-MM-DD (KST)
+    :return: (start, end) naive UTC datetimes of that KST day
+    """
+    end = datetime.strptime(day, '%Y-%m-%d') + timedelta(hours=KST_DAY_START_UTC_HOUR)
+    return end - timedelta(days=1), end
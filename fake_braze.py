@@ -0,0 +1,186 @@
+"""
+Local fake of the Braze REST endpoints used by the ETL, replaying recorded responses.
+
+    python fake_braze.py --fixtures braze_fixtures.json --port 8800 --latency 0.05 --throttle-rate 0.01
+    BRAZE_URL=http://127.0.0.1:8800 python braze_with_bq.py ...
+
+Fixtures are one JSON file:
+    {"campaigns": [<entries of /campaigns/list>],
+     "details": {<campaign_id>: <response of /campaigns/details>},
+     "data_series": {<campaign_id> or "<campaign_id>|<ending_at>": <response of /campaigns/data_series>}}
+and can be recorded from the real API with record_fixtures (python fake_braze.py --record ...).
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+CAMPAIGN_LIST_PAGE_SIZE = 100    # Braze /campaigns/list 페이지 크기
+
+
+def load_fixtures(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class _FakeBrazeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, braze_get 의 Session 재사용 그대로 측정
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        status, body, headers = fake.respond(url.path, params)
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeBrazeServer:
+    """
+    ThreadingHTTPServer serving /campaigns/list, /campaigns/details and /campaigns/data_series from fixtures.
+    :param latency: seconds added to every response
+    :param throttle_rate: share (0~1) of requests answered with 429 and Retry-After: retry_after
+    fail_next() scripts the status of the next requests (5xx bursts, 400, 429 with a given Retry-After).
+    Use as a context manager, or start()/stop(); .url is the base URL to give braze_with_bq.configure_braze.
+    """
+
+    def __init__(self, fixtures, latency=0.0, throttle_rate=0.0, retry_after=1, host='127.0.0.1', port=0, seed=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.stats = {'requests': 0, 'throttled': 0, 'not_found': 0, 'scripted': 0}
+        self._scripted = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _FakeBrazeHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def fail_next(self, *statuses, headers=None):
+        """Answers the next len(statuses) requests with these HTTP statuses (and headers), in order."""
+        with self._lock:
+            self._scripted.extend((status, headers or {}) for status in statuses)
+
+    def respond(self, path, params):
+        """:return: (status, JSON body, extra headers) of one request"""
+        with self._lock:
+            self.stats['requests'] += 1
+            scripted = self._scripted.popleft() if self._scripted else None
+            throttled = scripted is None and self.throttle_rate and self._random.random() < self.throttle_rate
+            if throttled:
+                self.stats['throttled'] += 1
+            elif scripted is not None:
+                self.stats['scripted'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if scripted is not None:
+            status, headers = scripted
+            return status, {'message': f"Scripted HTTP {status}"}, headers
+        if throttled:
+            return 429, {'message': 'Too many requests'}, {'Retry-After': str(self.retry_after)}
+
+        headers = {'X-RateLimit-Limit': '250000', 'X-RateLimit-Remaining': '250000', 'X-RateLimit-Reset': '3600'}
+        if path == '/campaigns/list':
+            page = int(params.get('page', 0))
+            campaigns = self.fixtures.get('campaigns', [])
+            return 200, {'campaigns': campaigns[page * CAMPAIGN_LIST_PAGE_SIZE:(page + 1) * CAMPAIGN_LIST_PAGE_SIZE],
+                         'message': 'success'}, headers
+        if path == '/campaigns/details':
+            result = self.fixtures.get('details', {}).get(params.get('campaign_id'))
+        elif path == '/campaigns/data_series':
+            data_series = self.fixtures.get('data_series', {})
+            result = data_series.get(f"{params.get('campaign_id')}|{params.get('ending_at')}",
+                                     data_series.get(params.get('campaign_id')))
+        else:
+            result = None
+        if result is None:
+            with self._lock:
+                self.stats['not_found'] += 1
+            return 400, {'message': f"Invalid campaign_id for {path}"}, headers
+        return 200, result, headers
+
+
+def record_fixtures(path, ending_at=None, campaign_ids=None):
+    """
+    Records the list, details and data_series (length=1, ending_at) responses of the real Braze API into a
+    fixtures file, through braze_with_bq.braze_get (BRAZE_URL / BRAZE_TOKEN).
+    :param campaign_ids: campaigns to record details/data_series for, defaults to every listed campaign
+    :return: the fixtures
+    """
+    import braze_with_bq
+
+    campaigns = braze_with_bq.get_all_campaign_list()
+    campaign_ids = list(campaign_ids) if campaign_ids is not None else [campaign['id'] for campaign in campaigns]
+    details = dict(zip(campaign_ids, braze_with_bq.fetch_campaign_details(campaign_ids)))
+    data_series = {}
+    for campaign_id in campaign_ids:
+        params = {'campaign_id': campaign_id, 'length': 1}
+        if ending_at:
+            params['ending_at'] = ending_at
+        data_series[campaign_id] = braze_with_bq.braze_get('/campaigns/data_series', params)
+    fixtures = {'campaigns': campaigns, 'details': details, 'data_series': data_series}
+    with open(path, 'w') as f:
+        json.dump(fixtures, f, ensure_ascii=False)
+    return fixtures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded Braze responses on a local HTTP server.')
+    parser.add_argument('--fixtures', required=True, help='fixtures JSON file')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After of the injected 429s')
+    parser.add_argument('--record', action='store_true',
+                        help='record the fixtures file from the real Braze API (BRAZE_URL/BRAZE_TOKEN) instead')
+    parser.add_argument('--ending-at', help='ending_at of the recorded data_series calls (--record)')
+    args = parser.parse_args()
+
+    if args.record:
+        recorded = record_fixtures(args.fixtures, ending_at=args.ending_at)
+        print(f"Recorded {len(recorded['campaigns'])} campaigns to {args.fixtures}")
+    else:
+        server = FakeBrazeServer(load_fixtures(args.fixtures), latency=args.latency, throttle_rate=args.throttle_rate,
+                                 retry_after=args.retry_after, host=args.host, port=args.port)
+        print(f"Fake Braze on {server.url}")
+        try:
+            server._httpd.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,88 @@
+"""
+Per-run timers and counters of the Braze -> BigQuery ETL.
+
+Timers record count/total/max seconds per name (Braze calls, BigQuery queries, load jobs), counters add up
+requests, rows and bytes. The module-level `metrics` is shared by every thread of a run (each RunContext of a
+multi-workspace run has its own RunMetrics instead) and is exported at the end as JSON or Prometheus text
+(exposition format, for a node_exporter textfile collector or a pushgateway).
+"""
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+METRICS_PREFIX = 'braze_etl'
+
+
+class RunMetrics:
+    """
+    Thread-safe timers and counters of one run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = {}
+        self.timers = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+            timer['count'] += 1
+            timer['total_seconds'] += seconds
+            if seconds > timer['max_seconds']:
+                timer['max_seconds'] = seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.counters = {}
+            self.timers = {}
+
+    def summary(self):
+        """
+        :return: {'run_seconds', 'counters', 'timers'} with the average seconds of every timer
+        """
+        with self._lock:
+            timers = {name: dict(timer, avg_seconds=timer['total_seconds'] / timer['count'])
+                      for name, timer in self.timers.items()}
+            return {'run_seconds': time.time() - self.started_at, 'counters': dict(self.counters), 'timers': timers}
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix=METRICS_PREFIX):
+        summary = self.summary()
+        lines = [f"# TYPE {prefix}_run_seconds gauge", f"{prefix}_run_seconds {summary['run_seconds']:.6f}"]
+        for name, value in sorted(summary['counters'].items()):
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+        for name, timer in sorted(summary['timers'].items()):
+            lines += [f"# TYPE {prefix}_{name}_seconds summary",
+                      f"{prefix}_{name}_seconds_count {timer['count']}",
+                      f"{prefix}_{name}_seconds_sum {timer['total_seconds']:.6f}",
+                      f"# TYPE {prefix}_{name}_seconds_max gauge",
+                      f"{prefix}_{name}_seconds_max {timer['max_seconds']:.6f}"]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Writes the summary to path, as Prometheus text for *.prom files and as JSON otherwise."""
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+
+metrics = RunMetrics()
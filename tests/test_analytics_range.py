@@ -0,0 +1,61 @@
+"""
+get_campaign_analytics_range_from_id_name: one /campaigns/data_series call for several days, every entry dated by
+its own 'time', against fake_braze.FakeBrazeServer.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import copy
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from braze_with_bq import RunContext, get_campaign_analytics_range_from_id_name  # noqa: E402
+from fake_braze import FakeBrazeServer  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures',
+                        'data_series.json')
+
+
+def entry(recorded, time, messages=True):
+    day_data = copy.deepcopy(recorded)
+    day_data['time'] = time
+    if not messages:
+        day_data['messages'] = {}
+    return day_data
+
+
+@pytest.fixture
+def recorded():
+    with open(FIXTURES) as f:
+        case = json.load(f)[0]
+    return case['campaign_id'], case['name'], case['response']['data'][0]
+
+
+@pytest.fixture
+def server(recorded):
+    campaign_id, _, day_data = recorded
+    # 06-01 ~ 06-04 요청: 범위 밖(05-31), 발송 없음(06-02, messages 비어 있음), 빠진 날짜(06-03)
+    data = [entry(day_data, '2022-05-31'), entry(day_data, '2022-06-01T00:00:00'),
+            entry(day_data, '2022-06-02', messages=False), entry(day_data, '2022-06-04')]
+    fixtures = {'campaigns': [], 'details': {},
+                'data_series': {f"{campaign_id}|2022-06-04": {'data': data, 'message': 'success'}}}
+    with FakeBrazeServer(fixtures, seed=0) as fake:
+        yield fake
+
+
+def test_range_rows_are_dated_by_entry_time(server, recorded):
+    campaign_id, name, day_data = recorded
+    ctx = RunContext(braze_url=server.url, braze_token='test')
+    try:
+        rows = get_campaign_analytics_range_from_id_name([campaign_id, name], '2022-06-01', '2022-06-04', ctx)
+    finally:
+        ctx.close()
+    assert server.stats['requests'] == 1
+    dates = [row['date'] for row in rows]
+    assert sorted(set(dates)) == ['2022-06-01', '2022-06-04']
+    assert dates.count('2022-06-01') == dates.count('2022-06-04') > 0     # 같은 응답을 복사한 두 날짜
+    assert all(row['id'] == campaign_id for row in rows)
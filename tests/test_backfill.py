@@ -0,0 +1,173 @@
+"""
+backfill() against fake_braze.FakeBrazeServer, with the BigQuery steps replaced by mocks.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import json
+import asyncio
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import braze_with_bq  # noqa: E402
+from braze_with_bq import BackfillCheckpoint, RunContext, backfill, run_analytics_pipeline  # noqa: E402
+from fake_braze import FakeBrazeServer  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures',
+                        'data_series.json')
+DAY = '2022-06-01'
+CAMPAIGNS = {'id': ['good', 'deleted'],
+             'name': ['220601_good$app_push$push$2206', '220601_deleted$app_push$push$2206']}
+
+
+class StubRouter:
+    """AnalyticsRouter without BigQuery: rows of the closed (loaded) routers end up in loaded."""
+    loaded = []
+
+    def __init__(self, client, tables):
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        return False
+
+    def write_rows(self, rows):
+        self.rows.extend(rows)
+
+    def close(self):
+        StubRouter.loaded.extend(self.rows)
+
+    def _discard(self):
+        self.rows = []
+
+
+@pytest.fixture
+def bq(monkeypatch):
+    """Mocks of the BigQuery steps of backfill, by name."""
+    mocks = {name: mock.MagicMock() for name in ('sync_missing_campaign_list', '_check_if_table_exists',
+                                                  'create_analytics_staging_tables', 'swap_in_reloaded_analytics',
+                                                  'drop_staging_tables', 'update_ga_rollup', 'join_loaded_days')}
+    mocks['missing_ga_shards'] = mock.MagicMock(return_value=[])
+    mocks['select_oneoff_campaigns_from_bq'] = mock.MagicMock(return_value=CAMPAIGNS)
+    for name, value in mocks.items():
+        monkeypatch.setattr(braze_with_bq, name, value)
+    monkeypatch.setattr(braze_with_bq, 'AnalyticsRouter', StubRouter)
+    StubRouter.loaded = []
+    return mocks
+
+
+@pytest.fixture
+def server():
+    with open(FIXTURES) as f:
+        response = json.load(f)[0]['response']
+    # 'deleted' 는 fixture 에 없음: Braze 에서 삭제된 캠페인처럼 400
+    with FakeBrazeServer({'campaigns': [], 'details': {}, 'data_series': {'good': response}}, seed=0) as fake:
+        yield fake
+
+
+@pytest.fixture
+def ctx(server, monkeypatch):
+    monkeypatch.setattr(braze_with_bq, 'backoff_delay', lambda attempt, *args, **kwargs: 0.0)
+    context = RunContext(braze_url=server.url, braze_token='test')
+    context._bq_client = mock.MagicMock(project='test')
+    yield context
+    context.close()
+
+
+@pytest.mark.parametrize('pipeline', [False, True])
+def test_deleted_campaign_does_not_fail_the_day(bq, server, ctx, tmp_path, pipeline):
+    failed_days = backfill(DAY, checkpoint_path=str(tmp_path / 'checkpoint.json'), pipeline=pipeline, ctx=ctx)
+    assert failed_days == []
+    assert server.stats['not_found'] == 1
+    assert {row['id'] for row in StubRouter.loaded} == {'good'}
+    assert ctx.metrics.summary()['counters']['braze_missing_campaigns'] == 1
+    bq['join_loaded_days'].assert_called_once()
+
+
+@pytest.mark.parametrize('pipeline', [False, True])
+def test_exhausted_retries_fail_the_day(bq, server, ctx, tmp_path, monkeypatch, pipeline):
+    monkeypatch.setattr(braze_with_bq, 'BRAZE_MAX_RETRIES', 1)
+    ctx.circuit_breaker = braze_with_bq.BrazeCircuitBreaker(failure_threshold=100, cooldown=0)
+    server.fail_next(503, 503, 503, 503)
+    failed_days = backfill(DAY, checkpoint_path=str(tmp_path / 'checkpoint.json'), pipeline=pipeline,
+                           max_workers=1, ctx=ctx)
+    assert failed_days == [DAY]
+    bq['join_loaded_days'].assert_not_called()
+
+
+def test_pipeline_leaves_the_loop_executor_alone(bq, ctx, tmp_path):
+    async def run():
+        failed_days = await run_analytics_pipeline(ctx.get_bq_client(), {DAY: CAMPAIGNS}, [], ctx=ctx)
+        return failed_days, await asyncio.to_thread(lambda: 'default executor still running')
+
+    assert asyncio.run(run()) == ([], 'default executor still running')
+    assert {row['id'] for row in StubRouter.loaded} == {'good'}
+
+
+@pytest.mark.parametrize('pipeline', [False, True])
+def test_failed_days_keep_their_rows(bq, server, ctx, tmp_path, monkeypatch, pipeline):
+    monkeypatch.setattr(braze_with_bq, 'BRAZE_MAX_RETRIES', 0)
+    ctx.circuit_breaker = braze_with_bq.BrazeCircuitBreaker(failure_threshold=100, cooldown=0)
+    server.fail_next(503, 503)      # 두 캠페인 모두 실패
+    failed_days = backfill(DAY, checkpoint_path=str(tmp_path / 'checkpoint.json'), pipeline=pipeline, ctx=ctx)
+    assert failed_days == [DAY]
+    bq['swap_in_reloaded_analytics'].assert_not_called()     # 실패한 날짜의 기존 row 는 지우지 않음
+    bq['drop_staging_tables'].assert_called_once()
+
+
+def test_only_loaded_days_are_swapped_in(bq, server, ctx, tmp_path):
+    calls = []
+    real_run_daily_steps = braze_with_bq.run_daily_steps
+
+    def run_daily_steps(client, day, campaigns, tables, ctx=None):
+        calls.append(day)
+        if day == '2022-06-02':
+            raise RuntimeError('load failed')
+        real_run_daily_steps(client, day, campaigns, tables, ctx)
+
+    with mock.patch.object(braze_with_bq, 'run_daily_steps', run_daily_steps):
+        failed_days = backfill(DAY, '2022-06-02', checkpoint_path=str(tmp_path / 'checkpoint.json'), ctx=ctx)
+    assert sorted(calls) == [DAY, '2022-06-02']
+    assert failed_days == ['2022-06-02']
+    (_, tables, staging_tables, campaigns_by_day), _ = bq['swap_in_reloaded_analytics'].call_args
+    assert list(campaigns_by_day) == [DAY]
+    bq['join_loaded_days'].assert_called_once()
+    assert bq['join_loaded_days'].call_args[0][1] == [DAY]
+
+
+def test_checkpoint_of_another_range_is_ignored(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = BackfillCheckpoint(path, DAY, '2022-06-03')
+    checkpoint.mark_done(DAY)
+    assert BackfillCheckpoint(path, DAY, '2022-06-03').completed == {DAY}
+    assert BackfillCheckpoint(path, DAY, '2022-06-05').completed == set()
+    assert BackfillCheckpoint(path, DAY).loaded == set()
+
+
+def test_day_without_ga_shard_is_loaded_but_not_joined(bq, server, ctx, tmp_path):
+    bq['missing_ga_shards'].side_effect = lambda client, dates, ctx=None: [day for day in dates if day == '2022-06-02']
+    path = str(tmp_path / 'checkpoint.json')
+    failed_days = backfill(DAY, '2022-06-02', checkpoint_path=path, ctx=ctx)
+    assert failed_days == ['2022-06-02']
+    assert bq['join_loaded_days'].call_args[0][1] == [DAY]
+    checkpoint = BackfillCheckpoint(path, DAY, '2022-06-02')
+    assert checkpoint.completed == {DAY}
+    assert checkpoint.loaded == {DAY, '2022-06-02'}     # 다음 실행은 GA 가 들어온 뒤 조인만
+
+
+def test_join_refuses_days_without_ga_shard(monkeypatch):
+    client = mock.MagicMock(project='test')
+    run_query = mock.MagicMock(return_value=[('ga_sessions_20220601',)])
+    monkeypatch.setattr(braze_with_bq, 'run_query', run_query)
+    with pytest.raises(RuntimeError, match='2022-06-02'):
+        braze_with_bq.replace_joined_analytics_for_dates(client, 'braze_campaigns.ga_bi_joined_analytics',
+                                                         [DAY, '2022-06-02'])
+    assert run_query.call_count == 1     # shard 확인만, 테이블은 건드리지 않음
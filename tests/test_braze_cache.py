@@ -0,0 +1,75 @@
+"""
+BrazeResponseCache: closed days never expire, open windows and details expire after open_day_ttl, offline mode
+replays every stored response.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import braze_with_bq  # noqa: E402
+from braze_with_bq import BrazeResponseCache  # noqa: E402
+
+CLOSED_DAY = {'campaign_id': 'c1', 'length': 1, 'ending_at': '2022-06-01'}
+OPEN_DAY = {'campaign_id': 'c1', 'length': 1, 'ending_at': '2099-01-01'}
+DETAILS = {'campaign_id': 'c1'}
+RESPONSE = {'message': 'success', 'data': []}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(braze_with_bq.time, 'time', fake.time)
+    return fake
+
+
+def store(path, open_day_ttl=60):
+    cache = BrazeResponseCache(str(path), open_day_ttl=open_day_ttl)
+    cache.put('/campaigns/data_series', CLOSED_DAY, RESPONSE)
+    cache.put('/campaigns/data_series', OPEN_DAY, RESPONSE)
+    cache.put('/campaigns/details', DETAILS, RESPONSE)
+    return cache
+
+
+def test_closed_day_never_expires(tmp_path, clock):
+    cache = store(tmp_path / 'cache.sqlite')
+    clock.now += 10 ** 9
+    assert cache.get('/campaigns/data_series', CLOSED_DAY) == RESPONSE
+    assert cache.stats['hits'] == 1
+    cache.close()
+
+
+def test_open_window_and_details_expire_after_ttl(tmp_path, clock):
+    cache = store(tmp_path / 'cache.sqlite')
+    clock.now += 59
+    assert cache.get('/campaigns/data_series', OPEN_DAY) == RESPONSE
+    assert cache.get('/campaigns/details', DETAILS) == RESPONSE
+    clock.now += 2
+    assert cache.get('/campaigns/data_series', OPEN_DAY) is None
+    assert cache.get('/campaigns/details', DETAILS) is None
+    assert cache.stats == {'hits': 2, 'misses': 0, 'expired': 2, 'stores': 3}
+    cache.close()
+
+
+def test_offline_replays_expired_responses(tmp_path, clock):
+    store(tmp_path / 'cache.sqlite').close()
+    clock.now += 10 ** 9
+    cache = BrazeResponseCache(str(tmp_path / 'cache.sqlite'), open_day_ttl=60, offline=True)
+    for endpoint, params in (('/campaigns/data_series', CLOSED_DAY), ('/campaigns/data_series', OPEN_DAY),
+                             ('/campaigns/details', DETAILS)):
+        assert cache.get(endpoint, params) == RESPONSE
+    with pytest.raises(LookupError):
+        cache.get('/campaigns/details', {'campaign_id': 'unknown'})
+    cache.close()
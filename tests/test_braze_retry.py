@@ -0,0 +1,96 @@
+"""
+Retry layer of braze_get (retries, circuit breaker, BrazeAPIError, Retry-After) against fake_braze.FakeBrazeServer.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import braze_with_bq  # noqa: E402
+from braze_with_bq import BrazeAPIError, BrazeCircuitBreaker, RunContext, braze_get  # noqa: E402
+from fake_braze import FakeBrazeServer  # noqa: E402
+
+DETAILS = {'message': 'success', 'name': 'retry$a$b$c', 'channels': ['email'], 'messages': {}}
+
+
+@pytest.fixture
+def server():
+    with FakeBrazeServer({'campaigns': [], 'details': {'c1': DETAILS}, 'data_series': {}}, seed=0) as fake:
+        yield fake
+
+
+@pytest.fixture
+def ctx(server, monkeypatch):
+    monkeypatch.setattr(braze_with_bq, 'backoff_delay', lambda attempt, *args, **kwargs: 0.0)
+    context = RunContext(braze_url=server.url, braze_token='test')
+    context.circuit_breaker = BrazeCircuitBreaker(failure_threshold=100, cooldown=0)
+    yield context
+    context.close()
+
+
+def get_details(ctx, campaign_id='c1'):
+    return braze_get('/campaigns/details', {'campaign_id': campaign_id}, ctx)
+
+
+def test_5xx_is_retried_until_success(server, ctx):
+    server.fail_next(503, 502, 500)
+    assert get_details(ctx) == DETAILS
+    assert server.stats['requests'] == 4
+
+
+def test_breaker_opens_after_consecutive_failures(server, ctx):
+    ctx.circuit_breaker = BrazeCircuitBreaker(failure_threshold=3, cooldown=0.3)
+    server.fail_next(503, 503, 503)
+    start = time.monotonic()
+    assert get_details(ctx) == DETAILS
+    assert time.monotonic() - start >= 0.3     # 3번째 실패에서 cooldown 동안 멈춤
+    assert server.stats['requests'] == 4
+
+
+def test_breaker_does_not_open_below_threshold(server, ctx):
+    ctx.circuit_breaker = BrazeCircuitBreaker(failure_threshold=3, cooldown=5)
+    server.fail_next(503, 503)
+    start = time.monotonic()
+    assert get_details(ctx) == DETAILS
+    assert time.monotonic() - start < 5
+    assert ctx.circuit_breaker.failures == 0   # 성공하면 연속 실패 수는 초기화
+
+
+def test_400_raises_without_retry(server, ctx):
+    with pytest.raises(BrazeAPIError) as error:
+        get_details(ctx, 'unknown')
+    assert error.value.status_code == 400
+    assert error.value.endpoint == '/campaigns/details'
+    assert server.stats['requests'] == 1
+
+
+def test_raises_when_retries_run_out(server, ctx, monkeypatch):
+    monkeypatch.setattr(braze_with_bq, 'BRAZE_MAX_RETRIES', 2)
+    server.fail_next(503, 503, 503, 503)
+    with pytest.raises(BrazeAPIError) as error:
+        get_details(ctx)
+    assert error.value.status_code == 503
+    assert server.stats['requests'] == 3
+
+
+def test_429_honours_retry_after(server, ctx):
+    server.fail_next(429, headers={'Retry-After': '0.4'})
+    start = time.monotonic()
+    assert get_details(ctx) == DETAILS
+    assert time.monotonic() - start >= 0.4
+    assert server.stats['requests'] == 2
+
+
+def test_metrics_are_counted_per_context(server, ctx):
+    ctx.circuit_breaker = BrazeCircuitBreaker(failure_threshold=100, cooldown=0, run_metrics=ctx.metrics)
+    shared_requests = braze_with_bq.metrics.summary()['counters'].get('braze_requests', 0)
+    server.fail_next(503)
+    get_details(ctx)
+    assert ctx.metrics.summary()['counters']['braze_requests'] == 2
+    assert ctx.metrics.summary()['counters']['braze_retries'] == 1
+    assert braze_with_bq.metrics.summary()['counters'].get('braze_requests', 0) == shared_requests
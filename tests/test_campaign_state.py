@@ -0,0 +1,123 @@
+"""
+CampaignStateIndex: a campaigns_list seed never skips a campaign, detail snapshots do; backfill only calls
+/campaigns/data_series for one-off campaigns that can have sent on the day, against fake_braze.FakeBrazeServer.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import json
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import braze_with_bq  # noqa: E402
+from braze_with_bq import CampaignDetail, CampaignStateIndex, RunContext, backfill  # noqa: E402
+from fake_braze import FakeBrazeServer  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures',
+                        'data_series.json')
+DAY = '2022-06-01'
+# 해당 날짜(KST, 05-31T15:00 ~ 06-01T15:00 UTC)에 발송된 캠페인은 sent 하나뿐
+CAMPAIGNS_LIST = [
+    {'id': 'sent', 'name': '220601_sent$app_push$push$2206', 'last_edited': '2022-05-30T01:00:00+00:00',
+     'last_sent': '2022-06-01T01:00:00+00:00'},
+    {'id': 'never_sent', 'name': '220601_draft$app_push$push$2206', 'last_edited': '2022-05-30T01:00:00+00:00',
+     'last_sent': None},
+    {'id': 'sent_before', 'name': '220601_early$app_push$push$2206', 'last_edited': '2022-05-20T01:00:00+00:00',
+     'last_sent': '2022-05-20T01:00:00+00:00'},
+]
+
+
+class StubRouter:
+    """AnalyticsRouter without BigQuery: keeps the written rows."""
+    rows = []
+
+    def __init__(self, client, tables):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def write_rows(self, rows):
+        StubRouter.rows.extend(rows)
+
+
+@pytest.fixture
+def state_index(tmp_path):
+    index = CampaignStateIndex(str(tmp_path / 'campaign_state.db'))
+    with mock.patch.object(braze_with_bq, 'run_query', return_value=[dict(row) for row in CAMPAIGNS_LIST]):
+        index.seed_from_bq(mock.MagicMock(project='test'))
+    yield index
+    index.close()
+
+
+def record_details(index, campaigns):
+    """Detail snapshots (taken now, after DAY ended) of the campaigns_list rows."""
+    for campaign in campaigns:
+        detail = CampaignDetail(campaign['id'], name=campaign['name'], updated_at=campaign['last_edited'],
+                                last_sent=campaign['last_sent'], archived=False, draft=False, enabled=True)
+        index.record_detail(detail.id, detail._asdict())
+
+
+def test_seed_alone_never_skips(state_index):
+    # campaigns_list.last_sent 는 최신이라는 보장이 없음: seed 만으로는 건너뛰지 않음
+    assert all(state_index.may_have_data(campaign['id'], DAY) for campaign in CAMPAIGNS_LIST)
+    assert state_index.stats['no_data'] == 0
+
+
+def test_detail_snapshot_decides_may_have_data(state_index):
+    record_details(state_index, CAMPAIGNS_LIST)
+    assert state_index.may_have_data('sent', DAY)
+    assert not state_index.may_have_data('never_sent', DAY)
+    assert not state_index.may_have_data('sent_before', DAY)
+    assert state_index.may_have_data('unknown', DAY)
+    assert state_index.may_have_data('never_sent', '2099-01-01')     # 스냅샷이 그 날짜가 끝나기 전
+    assert state_index.stats['no_data'] == 2
+
+
+def test_detail_without_enabled_is_not_disabled(tmp_path):
+    index = CampaignStateIndex(str(tmp_path / 'campaign_state.db'))
+    detail = CampaignDetail('recurring', name='daily_push$app_push$push$2206', updated_at='2022-05-30T01:00:00+00:00',
+                            last_sent='2022-06-01T01:00:00+00:00', archived=False, draft=False)   # enabled 없음
+    index.record_detail(detail.id, detail._asdict())
+    assert index.needs_refresh('recurring', DAY)
+    index.record_detail('stopped', detail._replace(id='stopped', enabled=False)._asdict())
+    assert not index.needs_refresh('stopped', DAY)
+    index.close()
+
+
+def test_backfill_skips_campaigns_without_data(state_index, tmp_path, monkeypatch):
+    record_details(state_index, CAMPAIGNS_LIST)
+    with open(FIXTURES) as f:
+        response = json.load(f)[0]['response']
+    fixtures = {'campaigns': [], 'details': {},
+                'data_series': {campaign['id']: response for campaign in CAMPAIGNS_LIST}}
+    campaigns = {'id': [campaign['id'] for campaign in CAMPAIGNS_LIST],
+                 'name': [campaign['name'] for campaign in CAMPAIGNS_LIST]}
+    for name in ('sync_missing_campaign_list', '_check_if_table_exists', 'create_analytics_staging_tables',
+                 'swap_in_reloaded_analytics', 'drop_staging_tables', 'update_ga_rollup', 'join_loaded_days'):
+        monkeypatch.setattr(braze_with_bq, name, mock.MagicMock())
+    monkeypatch.setattr(braze_with_bq, 'select_oneoff_campaigns_from_bq', mock.MagicMock(return_value=campaigns))
+    monkeypatch.setattr(braze_with_bq, 'missing_ga_shards', mock.MagicMock(return_value=[]))
+    monkeypatch.setattr(braze_with_bq, 'AnalyticsRouter', StubRouter)
+    StubRouter.rows = []
+
+    with FakeBrazeServer(fixtures, seed=0) as server:
+        ctx = RunContext(braze_url=server.url, braze_token='test')
+        ctx._bq_client = mock.MagicMock(project='test')
+        try:
+            failed_days = backfill(DAY, checkpoint_path=str(tmp_path / 'checkpoint.json'), state_index=state_index,
+                                   ctx=ctx)
+        finally:
+            ctx.close()
+
+    assert failed_days == []
+    assert server.stats['requests'] == 1       # never_sent, sent_before 는 호출하지 않음
+    assert {row['id'] for row in StubRouter.rows} == {'sent'}
+    braze_with_bq.join_loaded_days.assert_called_once()